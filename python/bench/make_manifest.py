@@ -0,0 +1,95 @@
+"""
+Write a synthetic memories_history.json whose download links point at
+stub_server.py. Sizes are drawn from log-normal distributions, one for
+images and one for videos, and a share of memories are overlay bundles.
+"""
+
+import argparse
+import json
+import random
+from datetime import datetime, timedelta, timezone
+from pathlib import Path
+
+
+def make_manifest(
+    count: int,
+    base_url: str,
+    video_ratio: float = 0.3,
+    overlay_ratio: float = 0.1,
+    image_size: int = 300_000,
+    video_size: int = 5_000_000,
+    sigma: float = 0.8,
+    seed: int = 0,
+) -> dict:
+    """
+    Manifest with count memories. image_size and video_size are the median
+    sizes in bytes; sigma is the spread of their log-normal distributions.
+    """
+    rnd = random.Random(seed)
+    start = datetime(2016, 1, 1, tzinfo=timezone.utc)
+    when = start
+    items = []
+    for n in range(count):
+        video = rnd.random() < video_ratio
+        kind = "mp4" if video else "jpg"
+        median = video_size if video else image_size
+        size = max(1024, int(rnd.lognormvariate(0, sigma) * median))
+        if rnd.random() < overlay_ratio:
+            kind = "z" + kind
+        # Now and then several memories share a second, as in real exports
+        if rnd.random() > 0.05:
+            when += timedelta(seconds=rnd.randint(1, 86_400))
+        lat = rnd.uniform(-60, 70)
+        lon = rnd.uniform(-180, 180)
+        items.append(
+            {
+                "Date": when.strftime("%Y-%m-%d %H:%M:%S UTC"),
+                "Media Type": "Video" if video else "Image",
+                "Location": f"Latitude, Longitude: {lat:.6f}, {lon:.6f}",
+                "Download Link": f"{base_url}/dmd/memories?mid={n}.{kind}.{size}",
+            }
+        )
+    items.reverse()  # exports list the newest memory first
+    return {"Saved Media": items}
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(
+        description="Generate a synthetic memories export."
+    )
+    parser.add_argument("--count", type=int, default=1000)
+    parser.add_argument("--base-url", default="http://127.0.0.1:8765")
+    parser.add_argument("--video-ratio", type=float, default=0.3)
+    parser.add_argument("--overlay-ratio", type=float, default=0.1)
+    parser.add_argument(
+        "--image-size", type=int, default=300_000, help="Median image size in bytes"
+    )
+    parser.add_argument(
+        "--video-size", type=int, default=5_000_000, help="Median video size in bytes"
+    )
+    parser.add_argument(
+        "--sigma", type=float, default=0.8, help="Spread of the size distributions"
+    )
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument(
+        "--output", type=Path, default=Path("./resources/json/memories_history.json")
+    )
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    manifest = make_manifest(
+        args.count,
+        args.base_url,
+        args.video_ratio,
+        args.overlay_ratio,
+        args.image_size,
+        args.video_size,
+        args.sigma,
+        args.seed,
+    )
+    args.output.parent.mkdir(parents=True, exist_ok=True)
+    with open(args.output, "w") as f:
+        json.dump(manifest, f, indent=4)
+    print(f"Wrote {args.count} memories to {args.output}")
@@ -0,0 +1,210 @@
+"""
+Benchmark download_files.py against stub_server.py at several concurrency
+settings. Each run downloads a fresh synthetic export in a temporary
+directory, and its throughput, per-file latency and peak RSS are reported.
+
+    python python/bench/run.py --count 500 --concurrency 10 50 100 --latency 50
+"""
+
+import argparse
+import json
+import os
+import shlex
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+from make_manifest import make_manifest
+from stub_server import add_server_arguments
+
+
+BENCH_DIR = Path(__file__).resolve().parent
+DOWNLOADER = BENCH_DIR.parent / "download_files.py"
+REPORT = Path("resources/temp/download_report.json")
+FILE_LOG = Path("resources/temp/download_files.jsonl")
+
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def start_server(args: argparse.Namespace, port: int) -> subprocess.Popen:
+    command = [sys.executable, str(BENCH_DIR / "stub_server.py"), "--port", str(port)]
+    for option in (
+        "latency",
+        "jitter",
+        "bandwidth",
+        "error_rate",
+        "throttle_rate",
+        "retry_after",
+        "seed",
+    ):
+        command += [f"--{option.replace('_', '-')}", str(getattr(args, option))]
+    server = subprocess.Popen(command)
+    deadline = time.monotonic() + 10
+    while time.monotonic() < deadline:
+        try:
+            socket.create_connection(("127.0.0.1", port), timeout=0.2).close()
+            return server
+        except OSError:
+            time.sleep(0.1)
+    server.kill()
+    raise RuntimeError("Stub server did not start")
+
+
+def peak_rss_mb(rusage) -> float:
+    # ru_maxrss is in KiB on Linux and in bytes on macOS
+    scale = 1 if sys.platform == "darwin" else 1024
+    return rusage.ru_maxrss * scale / (1024 * 1024)
+
+
+def percentile(values: list[float], q: float) -> float | None:
+    if not values:
+        return None
+    values = sorted(values)
+    return values[min(len(values) - 1, int(q * len(values)))]
+
+
+def run_once(args: argparse.Namespace, manifest: dict, concurrency: int) -> dict:
+    """
+    Download the manifest once in a scratch directory and measure it.
+    """
+    with tempfile.TemporaryDirectory(prefix="snapchat-bench-") as workdir:
+        manifest_path = Path(workdir, "resources/json/memories_history.json")
+        manifest_path.parent.mkdir(parents=True)
+        manifest_path.write_text(json.dumps(manifest))
+
+        command = [sys.executable, str(DOWNLOADER), "--concurrency", str(concurrency)]
+        command += shlex.split(args.downloader_args)
+        started = time.monotonic()
+        process = subprocess.Popen(
+            command,
+            cwd=workdir,
+            stdout=subprocess.DEVNULL,
+            stderr=subprocess.DEVNULL,
+        )
+        _, status, rusage = os.wait4(process.pid, 0)
+        wall = time.monotonic() - started
+        if os.waitstatus_to_exitcode(status):
+            raise RuntimeError(f"Downloader exited with status {status}")
+        report = json.loads(Path(workdir, REPORT).read_text())
+        with Path(workdir, FILE_LOG).open() as f:
+            totals = [json.loads(line)["total"] for line in f]
+
+    return {
+        "concurrency": concurrency,
+        "wall": wall,
+        "files": report["files_downloaded"],
+        "failed": report["files_failed"],
+        "errors": sum(report["errors"].values()),
+        "mb_per_s": report["bytes"] / (1024 * 1024) / report["elapsed"],
+        "files_per_s": report["files_downloaded"] / report["elapsed"],
+        "p50": percentile(totals, 0.5),
+        "p99": percentile(totals, 0.99),
+        "peak_rss_mb": peak_rss_mb(rusage),
+    }
+
+
+def summarize(runs: list[dict]) -> dict:
+    """
+    Median of each measurement over the repeats of one setting.
+    """
+    return {
+        key: statistics.median(run[key] for run in runs)
+        for key in runs[0]
+        if runs[0][key] is not None
+    }
+
+
+def print_table(results: list[dict]) -> None:
+    print()
+    print(
+        f"{'concurrency':>11} {'MB/s':>8} {'files/s':>8} {'p50 s':>7} "
+        f"{'p99 s':>7} {'RSS MB':>7} {'errors':>6} {'failed':>6}"
+    )
+    for r in results:
+        print(
+            f"{r['concurrency']:>11.0f} {r['mb_per_s']:>8.2f} {r['files_per_s']:>8.1f} "
+            f"{r.get('p50', 0):>7.3f} {r.get('p99', 0):>7.3f} "
+            f"{r['peak_rss_mb']:>7.1f} {r['errors']:>6.0f} {r['failed']:>6.0f}"
+        )
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Benchmark the downloader offline.")
+    parser.add_argument(
+        "--concurrency", type=int, nargs="+", default=[10, 25, 50, 100, 200]
+    )
+    parser.add_argument(
+        "--repeat", type=int, default=3, help="Runs per setting; medians are reported"
+    )
+    parser.add_argument("--count", type=int, default=500, help="Memories per run")
+    parser.add_argument("--video-ratio", type=float, default=0.3)
+    parser.add_argument("--overlay-ratio", type=float, default=0.1)
+    parser.add_argument(
+        "--image-size", type=int, default=300_000, help="Median image size in bytes"
+    )
+    parser.add_argument(
+        "--video-size", type=int, default=5_000_000, help="Median video size in bytes"
+    )
+    parser.add_argument("--sigma", type=float, default=0.8)
+    parser.add_argument(
+        "--downloader-args",
+        default="",
+        help='Extra options for download_files.py, e.g. "--adaptive"',
+    )
+    parser.add_argument("--output", type=Path, help="Also write the results as JSON")
+    add_server_arguments(parser)
+    return parser.parse_args()
+
+
+def main(args: argparse.Namespace) -> None:
+    port = free_port()
+    manifest = make_manifest(
+        args.count,
+        f"http://127.0.0.1:{port}",
+        args.video_ratio,
+        args.overlay_ratio,
+        args.image_size,
+        args.video_size,
+        args.sigma,
+        args.seed,
+    )
+    server = start_server(args, port)
+    results = []
+    try:
+        for concurrency in args.concurrency:
+            runs = []
+            for i in range(args.repeat):
+                run = run_once(args, manifest, concurrency)
+                print(
+                    f"concurrency {concurrency} run {i + 1}/{args.repeat}: "
+                    f"{run['mb_per_s']:.2f} MB/s, {run['wall']:.1f} s"
+                )
+                runs.append(run)
+            results.append(summarize(runs))
+    finally:
+        server.terminate()
+        server.wait()
+
+    print_table(results)
+    if args.output:
+        args.output.write_text(
+            json.dumps(
+                {
+                    "settings": vars(args) | {"output": str(args.output)},
+                    "results": results,
+                },
+                indent=4,
+            )
+        )
+
+
+if __name__ == "__main__":
+    main(parse_args())
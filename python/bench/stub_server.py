@@ -0,0 +1,188 @@
+"""
+Local stand-in for Snapchat's memories endpoint and its CDN, so that
+download_files.py can be benchmarked without a network.
+
+POST /dmd/memories?mid=... answers with a CDN URL for the memory, and
+GET /cdn/<mid> serves its body. A mid encodes the memory's kind and size as
+<n>.<kind>.<bytes> (see make_manifest.py), where kind is jpg, mp4, or
+zjpg/zmp4 for an overlay bundle around a JPEG or MP4.
+"""
+
+import argparse
+import asyncio
+import io
+import random
+import zipfile
+
+from aiohttp import web
+
+
+BLOCK = random.Random(0).randbytes(1024 * 1024)  # filler for bodies
+SEND_CHUNK = 64 * 1024
+JPEG_HEADER = b"\xff\xd8\xff\xe0\x00\x10JFIF\x00\x01\x01\x00\x00\x01\x00\x01\x00\x00"
+PNG_HEADER = b"\x89PNG\r\n\x1a\n"
+
+
+def filler(size: int, offset: int = 0) -> bytes:
+    offset %= len(BLOCK)
+    repeats = (offset + size) // len(BLOCK) + 1
+    return (BLOCK * repeats)[offset : offset + size]
+
+
+def media_body(kind: str, size: int) -> bytes:
+    if kind == "mp4":
+        ftyp = (24).to_bytes(4, "big") + b"ftypisom\x00\x00\x02\x00isomiso2"
+        moov = (16).to_bytes(4, "big") + b"moov" + (8).to_bytes(4, "big") + b"free"
+        payload = filler(max(0, size - len(ftyp) - len(moov) - 8))
+        mdat = (len(payload) + 8).to_bytes(4, "big") + b"mdat" + payload
+        return ftyp + moov + mdat
+    payload = filler(max(0, size - len(JPEG_HEADER) - 2))
+    return JPEG_HEADER + payload + b"\xff\xd9"
+
+
+def bundle_body(kind: str, size: int) -> bytes:
+    buf = io.BytesIO()
+    with zipfile.ZipFile(buf, "w", zipfile.ZIP_STORED) as z:
+        z.writestr(f"media~{size}.{kind}", media_body(kind, size))
+        z.writestr(f"overlay~{size}.png", PNG_HEADER + filler(size // 20))
+    return buf.getvalue()
+
+
+def body_for(mid: str) -> tuple[bytes, str]:
+    _, kind, size = mid.split(".")
+    if kind.startswith("z"):
+        return bundle_body(kind[1:], int(size)), "application/zip"
+    content_type = "video/mp4" if kind == "mp4" else "image/jpeg"
+    return media_body(kind, int(size)), content_type
+
+
+class StubServer:
+    def __init__(self, args: argparse.Namespace):
+        self.args = args
+        self.random = random.Random(args.seed)
+        self.requests = 0
+        self.errors = 0
+        self.throttled = 0
+
+    async def delay(self) -> None:
+        latency = self.args.latency / 1000
+        if self.args.jitter:
+            latency += self.random.expovariate(1000 / self.args.jitter)
+        if latency:
+            await asyncio.sleep(latency)
+
+    def injected_failure(self) -> web.Response | None:
+        """
+        A 503 or a 429 with Retry-After, at the configured rates.
+        """
+        roll = self.random.random()
+        if roll < self.args.error_rate:
+            self.errors += 1
+            return web.Response(status=503)
+        if roll < self.args.error_rate + self.args.throttle_rate:
+            self.throttled += 1
+            return web.Response(
+                status=429, headers={"Retry-After": str(self.args.retry_after)}
+            )
+        return None
+
+    async def resolve(self, request: web.Request) -> web.Response:
+        self.requests += 1
+        await self.delay()
+        if failure := self.injected_failure():
+            return failure
+        mid = request.query["mid"]
+        return web.Response(text=f"{request.scheme}://{request.host}/cdn/{mid}\n")
+
+    async def cdn(self, request: web.Request) -> web.StreamResponse:
+        self.requests += 1
+        await self.delay()
+        if failure := self.injected_failure():
+            return failure
+        mid = request.match_info["mid"]
+        data, content_type = body_for(mid)
+        etag = f'"{mid}"'
+        headers = {"ETag": etag, "Accept-Ranges": "bytes"}
+        status = 200
+        range_header = request.headers.get("Range", "")
+        if range_header.startswith("bytes=") and (
+            request.headers.get("If-Range", etag) == etag
+        ):
+            start = int(range_header[6:].split("-")[0])
+            headers["Content-Range"] = f"bytes {start}-{len(data) - 1}/{len(data)}"
+            data, status = data[start:], 206
+
+        response = web.StreamResponse(status=status, headers=headers)
+        response.content_type = content_type
+        response.content_length = len(data)
+        await response.prepare(request)
+        bandwidth = self.args.bandwidth * 1024
+        for start in range(0, len(data), SEND_CHUNK):
+            chunk = data[start : start + SEND_CHUNK]
+            await response.write(chunk)
+            if bandwidth:
+                await asyncio.sleep(len(chunk) / bandwidth)
+        await response.write_eof()
+        return response
+
+    async def stats(self, request: web.Request) -> web.Response:
+        return web.json_response(
+            {
+                "requests": self.requests,
+                "errors": self.errors,
+                "throttled": self.throttled,
+            }
+        )
+
+    def app(self) -> web.Application:
+        app = web.Application()
+        app.router.add_post("/dmd/memories", self.resolve)
+        app.router.add_get("/cdn/{mid}", self.cdn)
+        app.router.add_get("/stats", self.stats)
+        return app
+
+
+def add_server_arguments(parser: argparse.ArgumentParser) -> None:
+    parser.add_argument(
+        "--latency", type=float, default=20.0, help="Base latency per request in ms"
+    )
+    parser.add_argument(
+        "--jitter",
+        type=float,
+        default=10.0,
+        help="Mean of an exponentially distributed extra latency in ms",
+    )
+    parser.add_argument(
+        "--bandwidth",
+        type=float,
+        default=0.0,
+        help="Per-response bandwidth in KiB/s (0 for unlimited)",
+    )
+    parser.add_argument(
+        "--error-rate", type=float, default=0.0, help="Fraction of requests given a 503"
+    )
+    parser.add_argument(
+        "--throttle-rate",
+        type=float,
+        default=0.0,
+        help="Fraction of requests given a 429",
+    )
+    parser.add_argument(
+        "--retry-after", type=int, default=1, help="Retry-After seconds sent with 429s"
+    )
+    parser.add_argument("--seed", type=int, default=0)
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(
+        description="Serve a fake memories endpoint and CDN."
+    )
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    add_server_arguments(parser)
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    web.run_app(StubServer(args).app(), host=args.host, port=args.port, print=None)
@@ -0,0 +1,104 @@
+import json
+import os
+import shutil
+from pathlib import Path
+
+try:
+    import fcntl
+
+    FICLONE = 0x40049409  # Linux ioctl to share extents between two files
+except ImportError:  # Windows
+    fcntl = None
+
+
+class BlobStore:
+    """
+    Content-addressed store holding one copy of each distinct media file,
+    named by its SHA-256 digest. Per-memory filenames are materialized as
+    hardlinks (or reflinks) to the blob, so duplicate saves cost no extra disk.
+
+    An index of (size, validator) -> digest lets a CDN response whose headers
+    match a blob already on disk be linked without reading its body.
+
+    Tools that rewrite a file by replacing it (exiftool -overwrite_original
+    does) break the link for that one name and leave the blob untouched.
+    """
+
+    def __init__(self, root: Path, index_path: Path, link_mode: str = "hardlink"):
+        self.root = root
+        self.index_path = index_path
+        self.link_mode = link_mode
+        self.index: dict[str, str] = {}
+        self.duplicates = 0
+        self.bytes_saved = 0
+
+    def load(self) -> "BlobStore":
+        if self.index_path.exists():
+            try:
+                self.index = json.loads(self.index_path.read_text())
+            except ValueError:
+                self.index = {}  # rebuilt as blobs are seen again
+        return self
+
+    def save(self) -> None:
+        self.index_path.parent.mkdir(parents=True, exist_ok=True)
+        tmp = self.index_path.with_name(self.index_path.name + ".tmp")
+        tmp.write_text(json.dumps(self.index))
+        os.replace(tmp, self.index_path)
+
+    def blob_path(self, digest: str) -> Path:
+        return self.root / digest[:2] / digest
+
+    def lookup(self, size: int | None, validator: str | None) -> str | None:
+        """
+        Digest of a blob indexed with this size and validator, if there is
+        one. Only the index is consulted, so this never touches the disk; a
+        blob removed since it was indexed shows up when it is opened.
+        """
+        if size is None or not validator:
+            return None
+        return self.index.get(f"{size}:{validator}")
+
+    def ingest(self, src: Path, digest: str, validator: str | None) -> bool:
+        """
+        Move src into the store, or drop it if the blob already exists.
+        Returns True when src was a duplicate.
+        """
+        blob = self.blob_path(digest)
+        size = src.stat().st_size
+        if validator:
+            self.index[f"{size}:{validator}"] = digest
+        if blob.exists():
+            src.unlink()
+            self.duplicates += 1
+            self.bytes_saved += size
+            return True
+        blob.parent.mkdir(parents=True, exist_ok=True)
+        os.replace(src, blob)
+        return False
+
+    def materialize(self, digest: str, dest: Path) -> None:
+        """
+        Atomically point dest at the blob.
+        """
+        blob = self.blob_path(digest)
+        tmp = dest.with_name(dest.name + ".link")
+        tmp.unlink(missing_ok=True)
+        if self.link_mode == "reflink":
+            self._reflink(blob, tmp)
+        else:
+            try:
+                os.link(blob, tmp)
+            except OSError:  # file system without hardlinks
+                shutil.copyfile(blob, tmp)
+        os.replace(tmp, dest)
+
+    @staticmethod
+    def _reflink(src: Path, dest: Path) -> None:
+        with src.open("rb") as s, dest.open("wb") as d:
+            try:
+                if fcntl is None:
+                    raise OSError("reflinks are not supported here")
+                fcntl.ioctl(d.fileno(), FICLONE, s.fileno())
+            except OSError:  # not btrfs/XFS, or a different file system
+                shutil.copyfileobj(s, d)
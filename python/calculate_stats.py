@@ -1,15 +1,41 @@
+import argparse
 import pandas as pd
-import subprocess
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 from tqdm.asyncio import tqdm
 
+from coords import dms_to_degrees
+from exiftool import MISSING, ExifToolPool
+from layout import scan_media
+from tables import TableWriter
+from tagcache import TagCache
+from tagreader import read_tags
 
-file_directory = Path("./downloads")
-files_to_check = [
-    p
-    for p in file_directory.iterdir()
-    if p.is_file() and p.suffix.lower() in [".jpg", ".mp4"]
-]
+
+TAG_CACHE = Path("./resources/temp/tag_cache.json")
+CHUNK_SIZE = 10_000  # rows built and written at a time
+
+parser = argparse.ArgumentParser(description="Read the metadata of downloaded files.")
+parser.add_argument(
+    "--full",
+    action="store_true",
+    help=f"Re-read every file instead of reusing unchanged ones from {TAG_CACHE}",
+)
+parser.add_argument(
+    "--exiftool",
+    action="store_true",
+    help="Read every file with exiftool instead of the built-in header reader",
+)
+parser.add_argument(
+    "--json",
+    action="store_true",
+    help="Also write filemetadata.json, for reading by eye",
+)
+args = parser.parse_args()
+
+# One streaming walk over the downloads, in either layout
+file_stats = {Path(entry.path): entry.stat() for entry in scan_media()}
+files_to_check = list(file_stats)
 
 progress_bar = tqdm(
     total=len(files_to_check),
@@ -20,37 +46,63 @@ progress_bar = tqdm(
 
 file_df = pd.DataFrame(data=files_to_check, columns=["file"])
 
+TAGS = [
+    "-createdate",
+    "-gpslatitude",
+    "-gpslongitude",
+    "-IFD0:DateTime",
+    "-ExifIFD:DateTimeOriginal",
+    "-ExifIFD:DateTimeDigitized",
+    "-OffsetTimeOriginal",
+    "-GPSLatitudeRef",
+    "-GPSLongitudeRef",
+    "-QuickTime:CreationDate",
+    "-QuickTime:TrackCreateDate",
+    "-QuickTime:MediaCreateDate",
+    "-QuickTime:TimeZone",
+    "-QuickTime:GPSCoordinates",
+    "-xmp:gpslatitude",
+    "-xmp:gpslongitude",
+    "-QuickTime:LocationLatitude",
+    "-QuickTime:LocationLongitude",
+]
+
+cache = TagCache(TAG_CACHE, TAGS)
+if not args.full:
+    cache.load()
+file_tags = {}
+for p, stat in file_stats.items():
+    if (values := cache.get(p, stat)) is not None:
+        file_tags[p] = values
+progress_bar.update(len(file_tags))
+
+# New or changed files are read from their headers in-process where possible
+stale = [p for p in files_to_check if p not in file_tags]
+fresh = {}
+if not args.exiftool:
+    with ThreadPoolExecutor() as executor:
+        for p, values in zip(stale, executor.map(lambda p: read_tags(p, TAGS), stale)):
+            if values is not None:
+                fresh[p] = values
+                progress_bar.update()
+    stale = [p for p in stale if p not in fresh]
+
+# The rest go to exiftool, in one pass over long-lived processes
+with ExifToolPool() as pool:
+    fresh |= pool.read_tags(stale, TAGS, on_done=progress_bar.update)
+for p, values in fresh.items():
+    if values is None:  # exiftool failed on it, so it is read again next time
+        file_tags[p] = [MISSING] * len(TAGS)
+    else:
+        file_tags[p] = values
+        cache.put(p, file_stats[p], values)
+cache.prune(files_to_check)
+cache.save()
+
 
 def get_metadata(row: pd.Series) -> pd.Series:
 
-    file_path = row["file"]
-    command = [
-        "exiftool",
-        "-T",
-        "-createdate",
-        "-gpslatitude",
-        "-gpslongitude",
-        "-IFD0:DateTime",
-        "-ExifIFD:DateTimeOriginal",
-        "-ExifIFD:DateTimeDigitized",
-        "-OffsetTimeOriginal",
-        "-GPSLatitudeRef",
-        "-GPSLongitudeRef",
-        "-QuickTime:CreationDate",
-        "-QuickTime:TrackCreateDate",
-        "-QuickTime:MediaCreateDate",
-        "-QuickTime:TimeZone",
-        "-QuickTime:GPSCoordinates",
-        "-xmp:gpslatitude",
-        "-xmp:gpslongitude",
-        "-QuickTime:LocationLatitude",
-        "-QuickTime:LocationLongitude",
-        str(file_path),
-    ]
-    result = subprocess.run(
-        command, capture_output=True, text=True, check=False, timeout=30
-    )
-    metadata = result.stdout.strip().split("\n")[0].split("\t")
+    metadata = file_tags[row["file"]]
 
     row["createdate"] = metadata[0]
     row["gpslatitude"] = metadata[1]
@@ -70,66 +122,15 @@ def get_metadata(row: pd.Series) -> pd.Series:
     row["xmp:gpslongitude"] = metadata[15]
     # row["QuickTime:LocationLatitude"] = metadata[16]  # empty
     # row["QuickTime:LocationLongitude"] = metadata[17]  # empty
-    row["long"] = get_longitude(row)
-    row["lat"] = get_latitude(row)
-    progress_bar.update(1)
     return row
 
 
-def get_longitude(
-    row: pd.Series,
-) -> float | None:  # Changes DMS string to decimal degrees
-    gps_str = row["gpslongitude"]
-    if gps_str == "-":
-        return None
-    try:
-        parts = (
-            gps_str.replace(" deg ", "#")
-            .replace('"', "#")
-            .replace("'", "#")
-            .replace(" ", "")
-            .split("#")
-        )
-        degrees = float(parts[0])
-        minutes = float(parts[1]) / 60.00
-        seconds = float(parts[2]) / 3600.00
-        longitude = degrees + minutes + seconds
-        if gps_str[-1] in ["W", "S"]:
-            longitude = -longitude
-        return round(longitude, 6)
-    except Exception:
-        return None
-
-
-def get_latitude(
-    row: pd.Series,
-) -> float | None:  # Changes DMS string to decimal degrees
-    gps_str = row["gpslatitude"]
-    if gps_str == "-":
-        return None
-    try:
-        parts = (
-            gps_str.replace(" deg ", "#")
-            .replace('"', "#")
-            .replace("'", "#")
-            .replace(" ", "")
-            .split("#")
-        )
-        degrees = float(parts[0])
-        minutes = float(parts[1]) / 60.00
-        seconds = float(parts[2]) / 3600.00
-        latitude = degrees + minutes + seconds
-        if gps_str[-1] in ["W", "S"]:
-            latitude = -latitude
-        return round(latitude, 6)
-    except Exception:
-        return None
-
-
-df = file_df.apply(get_metadata, axis=1)
 progress_bar.close()
 
-print("Saving metadata to filemetadata.json")
-df.to_json(
-    "./resources/temp/filemetadata.json", orient="index", default_handler=str, indent=4
-)
+with TableWriter("filemetadata", json_export=args.json) as writer:
+    print(f"Saving metadata to {writer.path}")
+    for start in range(0, len(file_df), CHUNK_SIZE):
+        df = file_df[start : start + CHUNK_SIZE].apply(get_metadata, axis=1)
+        df["long"] = dms_to_degrees(df["gpslongitude"])
+        df["lat"] = dms_to_degrees(df["gpslatitude"])
+        writer.write(df)
@@ -0,0 +1,147 @@
+import asyncio
+import contextlib
+import json
+import os
+import threading
+from pathlib import Path
+
+
+CHECKPOINT = Path("./resources/temp/checkpoint.jsonl")
+LEGACY_CHECKPOINT = Path("./resources/temp/checkpoint.txt")
+
+
+class CheckpointJournal:
+    """
+    Append-only JSON Lines record of finished downloads.
+
+    Each line is {"path": ..., "size": ..., "sha256": ...} and is only written
+    after the body has been fully received and renamed into place. Records are
+    buffered and appended in batches, either once flush_every records are
+    pending or every flush_interval seconds, and the writes happen off the
+    event loop. A torn last line left by a crash is skipped on load, and the
+    file is rewritten without duplicates whenever it has grown stale.
+    """
+
+    def __init__(
+        self,
+        path: Path,
+        legacy_path: Path | None = None,
+        flush_every: int = 500,
+        flush_interval: float = 2.0,
+    ):
+        self.path = path
+        self.legacy_path = legacy_path
+        self.flush_every = flush_every
+        self.flush_interval = flush_interval
+        self.entries: dict[str, dict] = {}
+        self._pending: list[dict] = []
+        self._lines = 0
+        self._write_lock = threading.Lock()
+        self._flusher: asyncio.Task | None = None
+
+    def load(self, compact: bool = True) -> "CheckpointJournal":
+        """
+        Read the journal. Unless compact is False, as when another process
+        owns the file, it is also rewritten if it has grown stale.
+        """
+        needs_compact = False
+        if self.path.exists():
+            with self.path.open("r") as f:
+                for line in f:
+                    self._lines += 1
+                    try:
+                        record = json.loads(line)
+                        self.entries[record["path"]] = record
+                    except (ValueError, KeyError, TypeError):
+                        needs_compact = True  # torn or corrupt line
+
+        # Carry over the plain list of paths written by older versions
+        if self.legacy_path and self.legacy_path.exists():
+            for line in self.legacy_path.read_text().splitlines():
+                if line and line not in self.entries:
+                    size = os.stat(line).st_size if os.path.exists(line) else None
+                    self.entries[line] = {"path": line, "size": size, "sha256": None}
+            needs_compact = True
+
+        stale = needs_compact or self._lines > 2 * len(self.entries) + 1000
+        if compact and stale:
+            self.compact()
+            if self.legacy_path:
+                self.legacy_path.unlink(missing_ok=True)
+        return self
+
+    def is_done(self, path: Path) -> bool:
+        """
+        True when path was recorded as a complete, verified download. Only a
+        finished body is renamed into place, so an entry is trusted from
+        then on, even after the file is retagged (update_files changes its
+        size); unfinished transfers live in .part files and are checked
+        against their expected length when resumed.
+        """
+        return str(path) in self.entries
+
+    def rename(self, old: Path, new: Path) -> None:
+        """
+        Follow a finished file that was renamed after it was recorded. Call
+        compact() afterwards to write the change.
+        """
+        if (entry := self.entries.pop(str(old), None)) is not None:
+            self.entries[str(new)] = entry | {"path": str(new)}
+
+    def __len__(self) -> int:
+        return len(self.entries)
+
+    async def record(self, path: Path, size: int, sha256: str | None) -> None:
+        entry = {"path": str(path), "size": size, "sha256": sha256}
+        self.entries[entry["path"]] = entry
+        self._pending.append(entry)
+        if len(self._pending) >= self.flush_every:
+            await self.flush()
+
+    async def flush(self) -> None:
+        batch, self._pending = self._pending, []
+        if batch:
+            await asyncio.to_thread(self._append, batch)
+
+    def _append(self, batch: list[dict]) -> None:
+        data = "".join(json.dumps(entry) + "\n" for entry in batch)
+        with self._write_lock:
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            with self.path.open("a") as f:
+                f.write(data)
+                f.flush()
+                os.fsync(f.fileno())
+            self._lines += len(batch)
+
+    def compact(self) -> None:
+        """
+        Atomically rewrite the journal with exactly one line per entry.
+        """
+        with self._write_lock:
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            tmp = self.path.with_name(self.path.name + ".tmp")
+            with tmp.open("w") as f:
+                for entry in self.entries.values():
+                    f.write(json.dumps(entry) + "\n")
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp, self.path)
+            self._lines = len(self.entries)
+
+    async def _flush_periodically(self) -> None:
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            await self.flush()
+
+    async def __aenter__(self) -> "CheckpointJournal":
+        self._flusher = asyncio.create_task(self._flush_periodically())
+        return self
+
+    async def __aexit__(self, *exc) -> None:
+        if self._flusher:
+            self._flusher.cancel()
+            with contextlib.suppress(asyncio.CancelledError):
+                await self._flusher
+        await self.flush()
+        if self._lines > 2 * len(self.entries) + 1000:
+            await asyncio.to_thread(self.compact)
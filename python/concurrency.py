@@ -0,0 +1,191 @@
+import asyncio
+import contextlib
+import time
+from typing import Callable
+
+
+def is_congestion(exc: BaseException) -> bool:
+    """
+    True for errors that mean the far end wants fewer requests: 429s, 5xxs
+    and timeouts.
+    """
+    status = getattr(exc, "status", None)
+    if status is not None:
+        return status == 429 or status >= 500
+    return isinstance(exc, (asyncio.TimeoutError, TimeoutError))
+
+
+class Slot:
+    """
+    One in-flight request. Callers may overwrite latency (e.g. with time to
+    first byte) and nbytes before the slot is released.
+    """
+
+    def __init__(self):
+        self.started = time.monotonic()
+        self.latency: float | None = None
+        self.nbytes = 0
+
+
+class AdaptiveLimiter:
+    """
+    AIMD limit on the number of concurrent requests for one stage.
+
+    While the smoothed latency stays within latency_tolerance times the best
+    latency seen so far (plus latency_slack seconds, so that millisecond jitter
+    is ignored), every success grows the limit by 1/limit, which is about +1
+    per round trip. Latency above that shrinks it by 10%, and 429/5xx responses
+    or timeouts halve it, at most once per window of completions so that a
+    burst of errors is counted once. When a window finishes after the limit grew but
+    throughput did not improve, the limit steps back down.
+
+    With min_limit == max_limit the limiter behaves like a plain semaphore.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        initial: int,
+        min_limit: int,
+        max_limit: int,
+        latency_tolerance: float = 2.0,
+        latency_slack: float = 0.05,
+        log: Callable[[str], None] = print,
+    ):
+        self.name = name
+        self.min_limit = min_limit
+        self.max_limit = max_limit
+        self.limit = float(max(min_limit, min(initial, max_limit)))
+        self.latency_tolerance = latency_tolerance
+        self.latency_slack = latency_slack
+        self.log = log
+        self.in_flight = 0
+        self._changed = asyncio.Condition()
+        self._best_latency: float | None = None
+        self._smoothed_latency: float | None = None
+        self._window_start = time.monotonic()
+        self._window_done = 0
+        self._window_errors = 0
+        self._window_bytes = 0
+        self._window_latency = 0.0
+        self._window_limit = int(self.limit)
+        self._last_throughput = 0.0
+        self._backed_off = False
+
+    @property
+    def adaptive(self) -> bool:
+        return self.min_limit < self.max_limit
+
+    @contextlib.asynccontextmanager
+    async def slot(self):
+        async with self._changed:
+            await self._changed.wait_for(lambda: self.in_flight < int(self.limit))
+            self.in_flight += 1
+        slot = Slot()
+        try:
+            yield slot
+        except BaseException as e:
+            self._on_error(e)
+            raise
+        else:
+            if slot.latency is None:
+                slot.latency = time.monotonic() - slot.started
+            self._on_success(slot.latency, slot.nbytes)
+        finally:
+            async with self._changed:
+                self.in_flight -= 1
+                self._changed.notify_all()
+
+    def _on_success(self, latency: float, nbytes: int) -> None:
+        self._window_done += 1
+        self._window_bytes += nbytes
+        self._window_latency += latency
+        if not self.adaptive:
+            return
+        if self._best_latency is None or latency < self._best_latency:
+            self._best_latency = latency
+        if self._smoothed_latency is None:
+            self._smoothed_latency = latency
+        self._smoothed_latency += 0.2 * (latency - self._smoothed_latency)
+        threshold = self._best_latency * self.latency_tolerance + self.latency_slack
+        if self._smoothed_latency <= threshold:
+            self.limit = min(self.max_limit, self.limit + 1 / self.limit)
+        elif not self._backed_off:
+            self._set_limit(self.limit * 0.9, f"latency {self._smoothed_latency:.2f}s")
+        self._end_window_if_due()
+
+    def _on_error(self, exc: BaseException) -> None:
+        self._window_done += 1
+        self._window_errors += 1
+        if self.adaptive and is_congestion(exc) and not self._backed_off:
+            status = getattr(exc, "status", None)
+            reason = f"HTTP {status}" if status else type(exc).__name__
+            self._set_limit(self.limit * 0.5, reason)
+        self._end_window_if_due()
+
+    def _set_limit(self, limit: float, reason: str) -> None:
+        old = int(self.limit)
+        self.limit = max(self.min_limit, min(self.max_limit, limit))
+        self._backed_off = True
+        if int(self.limit) != old:
+            self.log(f"[{self.name}] concurrency {old} -> {int(self.limit)} ({reason})")
+
+    def _end_window_if_due(self) -> None:
+        if self._window_done < max(self._window_limit, 1):
+            return
+        elapsed = time.monotonic() - self._window_start
+        throughput = self._window_bytes / elapsed if elapsed > 0 else 0.0
+        grew = int(self.limit) > self._window_limit
+        if (
+            self.adaptive
+            and grew
+            and self._window_bytes
+            and throughput < self._last_throughput * 1.05
+        ):
+            self._set_limit(self.limit - 1, "no throughput gain")
+        elif grew:
+            successes = self._window_done - self._window_errors
+            avg = self._window_latency / successes if successes else 0.0
+            self.log(
+                f"[{self.name}] concurrency {self._window_limit} -> {int(self.limit)}"
+                f" (latency {avg:.2f}s, errors {self._window_errors}/{self._window_done})"
+            )
+        self._last_throughput = throughput
+        self._window_start = time.monotonic()
+        self._window_done = 0
+        self._window_errors = 0
+        self._window_bytes = 0
+        self._window_latency = 0.0
+        self._window_limit = int(self.limit)
+        self._backed_off = False
+
+
+class LoopLagMonitor:
+    """
+    Measures how long the event loop is blocked: a task sleeps for interval
+    seconds at a time, and any lateness on waking means the loop was busy
+    with something else.
+    """
+
+    def __init__(self, interval: float = 0.05):
+        self.interval = interval
+        self.max_lag = 0.0
+        self.total_lag = 0.0
+        self._task: asyncio.Task | None = None
+
+    async def _run(self) -> None:
+        while True:
+            started = time.monotonic()
+            await asyncio.sleep(self.interval)
+            lag = max(0.0, time.monotonic() - started - self.interval)
+            self.max_lag = max(self.max_lag, lag)
+            self.total_lag += lag
+
+    async def __aenter__(self) -> "LoopLagMonitor":
+        self._task = asyncio.create_task(self._run())
+        return self
+
+    async def __aexit__(self, *exc) -> None:
+        self._task.cancel()
+        with contextlib.suppress(asyncio.CancelledError):
+            await self._task
@@ -0,0 +1,52 @@
+import re
+
+import numpy as np
+import pandas as pd
+
+
+# 40 deg 26' 46.30" N, as exiftool prints a coordinate; the direction is
+# missing when a GPS value has no Ref tag
+DMS = (
+    r"(?P<degrees>\d+(?:\.\d*)?)\s*deg\s*"
+    r"(?P<minutes>\d+(?:\.\d*)?)'\s*"
+    r"(?P<seconds>\d+(?:\.\d*)?)\"\s*"
+    r"(?P<direction>[NSEW])?"
+)
+# 40 deg 26' 46.30" N, 79 deg 58' 56.00" W[, 0 m Above Sea Level], as
+# exiftool prints QuickTime:GPSCoordinates
+GPS_COORDINATES = r"(?P<latitude>[^,]+), (?P<longitude>[^,]+)(?:, .*)?"
+
+
+def dms_to_degrees(
+    values: pd.Series, digits: int = 6, require_direction: bool = False
+) -> pd.Series:
+    """
+    Decimal degrees for a column of DMS strings, negative to the south and
+    west, rounded to digits. Values that are missing ("-" or NaN) or do not
+    parse are NaN, as are values without a direction if require_direction.
+    """
+    # Exports repeat the same few places, so each distinct string is parsed once
+    codes, uniques = pd.factorize(values)
+    fields = (
+        pd.Series(uniques, dtype="string")
+        .str.extract(rf"^\s*{DMS}\s*$", flags=re.IGNORECASE)
+        .astype({"degrees": float, "minutes": float, "seconds": float})
+    )
+    degrees = fields["degrees"] + fields["minutes"] / 60 + fields["seconds"] / 3600
+    direction = fields["direction"].str.upper()
+    degrees = degrees.mask(direction.isin(["S", "W"]).fillna(False), -degrees)
+    if require_direction:
+        degrees = degrees.where(direction.notna())
+    # Python's round rather than NumPy's, which is off by one in the last
+    # digit for some values; it only runs once per distinct string
+    rounded = [round(x, digits) for x in degrees.to_numpy(dtype=float).tolist()]
+    # code -1, a missing value, picks the NaN appended at the end
+    return pd.Series(np.array(rounded + [np.nan])[codes], index=values.index)
+
+
+def split_gps_coordinates(values: pd.Series) -> pd.DataFrame:
+    """
+    The latitude and longitude halves of a column of GPSCoordinates strings,
+    still in DMS; NaN where the value is missing.
+    """
+    return values.astype("string").str.extract(rf"^{GPS_COORDINATES}$")
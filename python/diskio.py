@@ -0,0 +1,95 @@
+import asyncio
+import functools
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Callable
+
+
+class DiskWriter:
+    """
+    Runs blocking file-system calls on a small thread pool so that slow disks
+    or network storage never stall the event loop. At most max_pending
+    operations are queued at once, and callers wait for a free place before
+    submitting.
+    """
+
+    def __init__(self, threads: int, max_pending: int):
+        self._executor = ThreadPoolExecutor(threads, thread_name_prefix="writer")
+        self._slots = asyncio.Semaphore(max_pending)
+
+    async def submit(self, fn: Callable, *args) -> asyncio.Future:
+        """
+        Queue fn(*args) and return its future without waiting for it to run.
+        """
+        await self._slots.acquire()
+        loop = asyncio.get_running_loop()
+        future = loop.run_in_executor(self._executor, functools.partial(fn, *args))
+        future.add_done_callback(lambda _: self._slots.release())
+        return future
+
+    async def run(self, fn: Callable, *args):
+        return await (await self.submit(fn, *args))
+
+    def open(self, path: Path, mode: str, hasher=None) -> "AsyncFile":
+        return AsyncFile(self, functools.partial(open, path, mode), hasher)
+
+    def sink(self, factory: Callable, hasher=None) -> "AsyncFile":
+        """
+        Like open(), for any object with write() and close() built by factory.
+        """
+        return AsyncFile(self, factory, hasher)
+
+    def close(self) -> None:
+        self._executor.shutdown(wait=True)
+
+
+class AsyncFile:
+    """
+    A file (or any sink with write and close) written through a DiskWriter.
+    Each write is handed to the pool and the caller continues straight away,
+    so the next network read overlaps it. Only one write per file is in
+    flight at a time, which keeps the chunks in order. An optional hasher is
+    updated in the same thread as the write. busy accumulates the seconds
+    spent in those writes.
+    """
+
+    def __init__(self, writer: DiskWriter, opener: Callable, hasher=None):
+        self.writer = writer
+        self.opener = opener
+        self.hasher = hasher
+        self._file = None
+        self._pending: asyncio.Future | None = None
+        self.busy = 0.0
+
+    def _write(self, data: bytes) -> None:
+        started = time.perf_counter()
+        self._file.write(data)
+        if self.hasher is not None:
+            self.hasher.update(data)
+        self.busy += time.perf_counter() - started
+
+    async def write(self, data: bytes, on_done: Callable[[], None] | None = None):
+        """
+        Queue data behind the previous write; on_done runs once it is on disk
+        (or has failed).
+        """
+        await self.drain()
+        self._pending = await self.writer.submit(self._write, data)
+        if on_done is not None:
+            self._pending.add_done_callback(lambda _: on_done())
+
+    async def drain(self) -> None:
+        if self._pending is not None:
+            pending, self._pending = self._pending, None
+            await pending
+
+    async def __aenter__(self) -> "AsyncFile":
+        self._file = await self.writer.run(self.opener)
+        return self
+
+    async def __aexit__(self, *exc) -> None:
+        try:
+            await self.drain()
+        finally:
+            await self.writer.run(self._file.close)
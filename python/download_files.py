@@ -1,164 +1,728 @@
 import aiohttp
+import argparse
 import asyncio
-import httpx
+import collections
+import functools
+import hashlib
 import json
 import os
-import pytz
-import string
+import sys
 import time
-from datetime import datetime
+import zlib
 from pathlib import Path
 from tqdm import tqdm
 
+from blobstore import BlobStore
+from checkpoint import CHECKPOINT, LEGACY_CHECKPOINT, CheckpointJournal
+from concurrency import AdaptiveLimiter, LoopLagMonitor
+from diskio import DiskWriter
+from layout import DOWNLOADS, LAYOUTS, media_path, scan_media
+from manifest import Manifest, load_manifest
+from media import (
+    BundleWriter,
+    CorruptMediaError,
+    extract_bundle,
+    read_head,
+    sniff_extension,
+    verify_media,
+)
+from metrics import DownloadMetrics
+from ratelimit import RateControl, TokenBucket, parse_rate
+from retries import (
+    RetryScheduler,
+    backoff_delay,
+    is_permanent,
+    load_retry_queue,
+    parse_retry_after,
+    save_retry_queue,
+)
+from sharding import Shard, merge_shards, parse_shard, run_local_workers
+
 
 CONCURRENCY = 50
-RETRIES = 3
-OUTPUT_DIR = Path("./downloads")
-CHECKPOINT = Path("./resources/temp/checkpoint.txt")
+MIN_CONCURRENCY = 4  # bounds used by --adaptive
+MAX_CONCURRENCY = 200
+RETRIES = 5  # attempts per file before it goes to the retry queue
+BACKOFF_BASE = 1.0  # seconds
+BACKOFF_MAX = 60.0  # seconds
+DNS_CACHE_TTL = 300  # seconds
+KEEPALIVE_TIMEOUT = 30  # seconds
+RESOLVE_TIMEOUT = aiohttp.ClientTimeout(total=30)
+CHUNK_SIZE = 1024 * 1024  # bytes read from a response body at a time
+MAX_BUFFERED_BYTES = 64 * 1024 * 1024  # across all in-flight downloads
+WRITER_THREADS = 8
+WRITER_QUEUE = 64  # disk operations queued for the writer threads at once
+OUTPUT_DIR = DOWNLOADS
+BLOB_DIR = OUTPUT_DIR / ".blobs"
+BLOB_INDEX = Path("./resources/temp/blob_index.json")
+RETRY_QUEUE = Path("./resources/temp/retry_queue.jsonl")
+REPORT = Path("./resources/temp/download_report.json")
+FILE_LOG = Path("./resources/temp/download_files.jsonl")  # timings of each file
+LIMITS_FILE = Path("./resources/temp/limits.json")  # rates changed during a run
+
+
+class ByteBudget:
+    """
+    Cap on the number of response bytes held in memory across all downloads.
+    A chunk must be reserved before it is read and is released once written.
+    Releasing is synchronous so that it can run from a write's done callback.
+    """
+
+    def __init__(self, limit: int):
+        self.limit = limit
+        self.in_use = 0
+        self._waiters = collections.deque()
+
+    async def acquire(self, n: int) -> int:
+        n = min(n, self.limit)
+        while self.in_use + n > self.limit:
+            waiter = asyncio.get_running_loop().create_future()
+            self._waiters.append(waiter)
+            await waiter
+        self.in_use += n
+        return n
+
+    def release(self, n: int) -> None:
+        self.in_use -= n
+        while self._waiters:
+            waiter = self._waiters.popleft()
+            if not waiter.done():
+                waiter.set_result(None)
+
+
+def create_session(limit: int) -> aiohttp.ClientSession:
+    """
+    Return one long-lived session shared by link resolution and CDN fetches.
+    Connections are kept alive and pooled per host, and DNS lookups are cached,
+    so a new TCP+TLS handshake is only paid when the pool has no idle socket.
+    limit should be the most downloads the limiters can let run at once: each
+    holds one connection at a time, and any one host may get all of them, so
+    a slot never waits on the pool and TTFB measures the server alone.
+    """
+    connector = aiohttp.TCPConnector(
+        limit=limit,
+        limit_per_host=limit,
+        ttl_dns_cache=DNS_CACHE_TTL,
+        keepalive_timeout=KEEPALIVE_TIMEOUT,
+    )
+    return aiohttp.ClientSession(connector=connector)
+
+
+async def get_cdn_url(session: aiohttp.ClientSession, download_link: str) -> str:
+    async with session.post(
+        download_link,
+        headers={"Content-Type": "application/x-www-form-urlencoded"},
+        timeout=RESOLVE_TIMEOUT,
+    ) as response:
+        response.raise_for_status()
+        return (await response.text()).strip()
 
 
-def load_checkpoint():
-    if CHECKPOINT.exists():
-        return set(CHECKPOINT.read_text().splitlines())
-    return set()
+def part_paths(path: Path) -> tuple[Path, Path]:
+    """
+    Return the partial download kept next to path and its JSON sidecar, which
+    records the expected total length and the validator (ETag/Last-Modified).
+    """
+    part = path.with_name(path.name + ".part")
+    return part, part.with_name(part.name + ".json")
+
+
+def load_resume_point(path: Path) -> tuple[int, str | None]:
+    part, meta_path = part_paths(path)
+    try:
+        meta = json.loads(meta_path.read_text())
+        offset = part.stat().st_size
+    except (OSError, ValueError):
+        return 0, None
+    validator = meta.get("validator")
+    if not validator or (meta.get("length") and offset >= meta["length"]):
+        return 0, None
+    return offset, validator
 
 
-def save_to_checkpoint(path: Path):
-    with CHECKPOINT.open("a") as f:
-        f.write(str(path) + "\n")
+def hash_file(path: Path):
+    digest = hashlib.sha256()
+    with path.open("rb") as f:
+        while chunk := f.read(CHUNK_SIZE):
+            digest.update(chunk)
+    return digest
 
 
-def number_to_letters(n: int) -> str:
+def discard_partial(path: Path) -> None:
+    for p in part_paths(path):
+        p.unlink(missing_ok=True)
+
+
+def sniffed_path(path: Path, head: bytes) -> Path:
     """
-    Convert a 0-indexed number to letters (A-Z, AA-ZZ, etc.)
-    0 -> A, 25 -> Z, 26 -> AA, 27 -> AB, ...
+    path with the extension matching the media's first bytes, keeping the
+    planned one when the content is not recognised.
     """
-    letters = string.ascii_uppercase
-    result = ""
-    while True:
-        n, rem = divmod(n, 26)
-        result = letters[rem] + result
-        if n == 0:
-            break
-        n -= 1
-    return result
+    ext = sniff_extension(head)
+    return path.with_suffix(f".{ext}") if ext in ("jpg", "mp4") else path
 
 
-def get_letter_suffix(index: int) -> str:
+async def read_chunk(
+    resp: aiohttp.ClientResponse, budget: ByteBudget, bandwidth: TokenBucket
+):
     """
-    Return letter suffix for a given index
+    Reserve room in the budget and read the next chunk of the body, then
+    take its size from the bandwidth bucket.
+    Returns (chunk, reserved); an empty chunk means the body is finished and
+    holds no reservation.
     """
-    return f"-{number_to_letters(index)}"
+    reserved = await budget.acquire(CHUNK_SIZE)
+    try:
+        chunk = await resp.content.read(CHUNK_SIZE)
+        await bandwidth.acquire(len(chunk))
+    except BaseException:
+        budget.release(reserved)
+        raise
+    if not chunk:
+        budget.release(reserved)
+        return chunk, 0
+    return chunk, reserved
+
+
+def parse_content_range(header: str | None) -> tuple[int, int | None] | None:
+    """
+    "bytes 100-199/1000" -> (100, 1000); the total is None when it is "*".
+    """
+    if not header or not header.startswith("bytes "):
+        return None
+    try:
+        span, total = header[6:].split("/")
+        start = int(span.split("-")[0])
+        return start, None if total == "*" else int(total)
+    except ValueError:
+        return None
+
+
+async def fetch_to_file(
+    session: aiohttp.ClientSession,
+    cdn_url: str,
+    path: Path,
+    budget: ByteBudget,
+    bandwidth: TokenBucket,
+    writer: DiskWriter,
+    timings: dict,
+    store: BlobStore | None = None,
+) -> tuple[Path, int, int, str | None]:
+    """
+    Stream a CDN body to path chunk by chunk through a .part file, renaming it
+    into place only once the whole body has arrived. The extension is chosen
+    from the body's first bytes rather than the plan, and an overlay bundle
+    (a ZIP) is unpacked as it streams in. An interrupted transfer
+    leaves the .part file behind, and the next attempt continues it with a
+    Range request. A full fetch happens instead when the server ignores the
+    range or the validator no longer matches.
+    A complete body must also pass verify_media (JPEG end marker, MP4 box
+    walk); one that fails raises CorruptMediaError and is discarded, so the
+    retry downloads it afresh.
+    Returns (final path, bytes transferred by this call, final size, sha256
+    hex digest); for an overlay bundle the size is the main media's and
+    there is no digest.
+    Seconds to first byte, for the body transfer and spent writing to disk
+    are stored in timings["ttfb"], ["transfer"] and ["write"].
+    All file-system work goes through writer, so each chunk's write overlaps
+    the read of the next one.
+    With a store, the finished body becomes a blob and path a link to it, and
+    a response whose size and validator match a known blob is linked without
+    reading the body at all.
+    """
+    part, meta_path = part_paths(path)
+    offset, validator = await writer.run(load_resume_point, path)
+    headers = {"Accept-Encoding": "identity"}
+    if offset:
+        headers["Range"] = f"bytes={offset}-"
+        headers["If-Range"] = validator
+
+    started = time.monotonic()
+    async with session.get(cdn_url, headers=headers) as resp:
+        timings["ttfb"] = time.monotonic() - started
+        started = time.monotonic()
+        if resp.status == 416:  # Range Not Satisfiable: the partial is stale
+            await writer.run(discard_partial, path)
+        resp.raise_for_status()
+
+        content_range = parse_content_range(resp.headers.get("Content-Range"))
+        new_validator = resp.headers.get("ETag") or resp.headers.get("Last-Modified")
+        if resp.status == 206 and content_range and content_range[0] == offset:
+            length = content_range[1]
+        else:
+            offset = 0
+            length = resp.content_length
+        if offset and new_validator != validator:
+            # The server ignored If-Range, so the kept bytes are another version
+            await writer.run(discard_partial, path)
+            raise aiohttp.ClientPayloadError("Partial download changed on server")
+
+        known = store.lookup(length, new_validator) if store and not offset else None
+        if known:
+            try:
+                head = await writer.run(read_head, store.blob_path(known))
+            except FileNotFoundError:  # the blob was removed since it was indexed
+                known = None
+        if known:
+            final = sniffed_path(path, head)
+            await writer.run(store.materialize, known, final)
+            await writer.run(discard_partial, path)
+            timings["transfer"] = 0.0
+            timings["write"] = time.monotonic() - started
+            store.duplicates += 1
+            store.bytes_saved += length
+            return final, 0, length, known
+
+        meta = json.dumps({"length": length, "validator": new_validator})
+        await writer.run(meta_path.write_text, meta)
+        digest = await writer.run(hash_file, part) if offset else hashlib.sha256()
+        size = 0
+        chunk, reserved = await read_chunk(resp, budget, bandwidth)
+        bundle = None
+        if not offset and sniff_extension(chunk) == "zip":
+            bundle = BundleWriter(path)
+            sink = writer.sink(lambda: bundle, digest)
+        else:
+            sink = writer.open(part, "ab" if offset else "wb", digest)
+        try:
+            async with sink as f:
+                while chunk:
+                    size += len(chunk)
+                    # The reservation is held until the chunk is on disk
+                    await f.write(chunk, functools.partial(budget.release, reserved))
+                    reserved = 0
+                    chunk, reserved = await read_chunk(resp, budget, bandwidth)
+        except BaseException:
+            budget.release(reserved)
+            if bundle:
+                await writer.run(bundle.abort)
+            raise
+        timings["transfer"] = time.monotonic() - started
+
+    started = time.monotonic()
+    try:
+        if length is not None and offset + size != length:
+            raise aiohttp.ClientPayloadError(
+                f"Incomplete body: got {offset + size} of {length} bytes"
+            )
+        if bundle:
+            final = await writer.run(bundle.commit)
+    except BaseException as e:
+        if bundle:
+            await writer.run(bundle.abort)
+        if isinstance(e, (CorruptMediaError, zlib.error)):
+            await writer.run(discard_partial, path)
+        raise
+    sha256 = digest.hexdigest()
+    unpacked = bool(bundle)
+    if not bundle:
+        head = await writer.run(read_head, part)
+        try:
+            if sniff_extension(head) == "zip":
+                # A resumed overlay bundle, unpacked now that it is complete
+                final = await writer.run(extract_bundle, part, path)
+                unpacked = True
+            else:
+                await writer.run(verify_media, part)
+        except (CorruptMediaError, zlib.error):
+            # Complete but broken, so the next attempt starts from scratch
+            await writer.run(discard_partial, path)
+            raise
+        if sniff_extension(head) != "zip":
+            final = sniffed_path(path, head)
+            if store:
+                await writer.run(store.ingest, part, sha256, new_validator)
+                await writer.run(store.materialize, sha256, final)
+            else:
+                await writer.run(os.replace, part, final)
+    await writer.run(functools.partial(meta_path.unlink, missing_ok=True))
+    timings["write"] = f.busy + time.monotonic() - started
+    if unpacked:
+        # The size and digest so far are the archive's, not the media's
+        return final, size, (await writer.run(final.stat)).st_size, None
+    return final, size, offset + size, sha256
+
+
+async def download_one(
+    session, limits, rates, budget, writer, journal, store, job, metrics, timings
+):
+    """
+    Make a single attempt at one memory, recording its phase timings into
+    timings. Errors propagate to the caller, which decides whether and when
+    to retry.
+    """
+    attempt_started = time.monotonic()
+    path = Path(job["path"])
+    await rates["resolve_rate"].acquire()
+    async with limits["resolve"].slot():
+        started = time.monotonic()
+        cdn_url = await get_cdn_url(session, job["url"])
+        timings["resolve"] = time.monotonic() - started
+
+    await writer.run(functools.partial(path.parent.mkdir, parents=True, exist_ok=True))
+    async with limits["fetch"].slot() as slot:
+        path, transferred, size, sha256 = await fetch_to_file(
+            session, cdn_url, path, budget, rates["bandwidth"], writer, timings, store
+        )
+        slot.latency = timings.get("ttfb")
+        slot.nbytes = transferred
 
+    await journal.record(path, size, sha256)
+    timings["total"] = time.monotonic() - attempt_started
+    metrics.record_file(path, timings, transferred)
 
-async def utc_filename(timestamp: str, url: str, index: int) -> Path:
+
+def iter_downloads(manifest: Manifest, layout: str = "flat"):
     """
-    Return a Path with format YYYY-MM-DD_HH-MM-SS-A.jpg/mp4
-    Supports multiple files per second with AA, AB, ... if needed
+    Yield the download plan: a job per memory with its url, timestamp, index
+    and final path, where index is the deterministic per-timestamp position
+    used for the filename suffix.
     """
-    dt = datetime.strptime(timestamp, "%Y-%m-%d %H:%M:%S UTC")
-    dt = dt.replace(tzinfo=pytz.utc)
-    ext = "mp4" if ".mp4" in url.lower() else "jpg"
-    suffix = get_letter_suffix(index)
-    filename = f"{dt.strftime('%Y-%m-%d_%H-%M-%S')}{suffix}.{ext}"
-    return OUTPUT_DIR / filename
+    for memory in manifest:
+        yield {
+            "url": memory.url,
+            "timestamp": memory.timestamp,
+            "index": memory.index,
+            "media_type": memory.media_type,
+            "path": str(media_path(memory.filename, layout, OUTPUT_DIR)),
+        }
 
 
-async def get_cdn_url(download_link: str) -> str:
-    async with httpx.AsyncClient(timeout=30.0) as client:
-        response = await client.post(
-            download_link,
-            headers={"Content-Type": "application/x-www-form-urlencoded"},
-        )
-        response.raise_for_status()
-        return response.text.strip()
+def list_downloaded() -> dict[str, os.DirEntry]:
+    """
+    The media files already under OUTPUT_DIR in either layout, by stem, from
+    one scan of each directory rather than one stat per planned file. Stems
+    are compared because the extension on disk follows the content, which
+    may differ from the plan, and because a file counts as downloaded
+    whichever layout it was saved in.
+    """
+    return {entry.name.rsplit(".", 1)[0]: entry for entry in scan_media(OUTPUT_DIR)}
 
 
-async def download_one(session, sem, url, timestamp, index, failures, stats):
-    async with sem:
-        for attempt in range(1, RETRIES + 1):
-            try:
-                cdn_url = await get_cdn_url(url)
-                url = cdn_url
-                path = await utc_filename(timestamp, url, index)
-                if path.exists() or str(path) in stats["done"]:
-                    return
-
-                async with session.get(url) as resp:
-                    resp.raise_for_status()
-                    data = await resp.read()
-
-                path.parent.mkdir(parents=True, exist_ok=True)
-                path.write_bytes(data)
-                stats["mb"] += len(data) / (1024 * 1024)
-                save_to_checkpoint(path)
-                stats["done"].add(str(path))
-                return
-
-            except Exception as e:
-                if attempt == RETRIES:
-                    failures.append((url, str(e)))
-                await asyncio.sleep(0.3 * attempt)
-
-
-async def main():
-    with open("./resources/json/memories_history.json", "r") as f:
-        memories = json.load(f)["Saved Media"]
-
-    # Prepare deterministic index per timestamp
-    timestamp_index_map = {}
-    tasks_to_download = []
-
-    for item in memories:
-        url = item.get("Download Link")
-        ts = item.get("Date")
-        if not url or not ts:
-            continue
-
-        # Determine deterministic index for this timestamp
-        index = timestamp_index_map.get(ts, 0)
-        timestamp_index_map[ts] = index + 1
-
-        tasks_to_download.append((url, ts, index))
-
-    stats = {"mb": 0.0, "done": load_checkpoint()}
-    failures = []
-    sem = asyncio.Semaphore(CONCURRENCY)
+def in_shard(jobs, shard: Shard | None):
+    """
+    Keep only the jobs that belong to shard (all of them without one).
+    """
+    for job in jobs:
+        if shard is None or shard.contains(Path(job["path"]).stem):
+            yield job
 
-    async with aiohttp.ClientSession() as session:
-        start_time = time.time()
-        progress = tqdm(total=len(tasks_to_download), desc="Downloading", unit="file")
 
-        async def wrapped(url, timestamp, index):
-            await download_one(session, sem, url, timestamp, index, failures, stats)
-            progress.update(1)
+def remaining(
+    jobs, downloaded: dict[str, os.DirEntry], journals: list[CheckpointJournal]
+):
+    """
+    Drop planned jobs whose final file is already on disk and was recorded
+    as finished, before any network request is made for them. A file the
+    journals do not know, e.g. one left by a crash between the rename and
+    the journal write, is downloaded again.
+    """
+    for job in jobs:
+        entry = downloaded.get(Path(job["path"]).stem)
+        if entry is None or not any(
+            journal.is_done(Path(entry.path)) for journal in journals
+        ):
+            yield job
+
 
-        await asyncio.gather(
-            *(
-                wrapped(url, timestamp, index)
-                for url, timestamp, index in tasks_to_download
-            )
+def create_limiters(args: argparse.Namespace) -> dict[str, AdaptiveLimiter]:
+    """
+    One limiter each for link resolution and CDN fetches, so that throttling
+    by Snapchat's endpoint does not hold back transfers from the CDN.
+    """
+    if args.adaptive:
+        bounds = (args.min_concurrency, args.max_concurrency)
+    else:
+        bounds = (args.concurrency, args.concurrency)
+    return {
+        stage: AdaptiveLimiter(stage, args.concurrency, *bounds, log=tqdm.write)
+        for stage in ("resolve", "fetch")
+    }
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Download Snapchat memories.")
+    parser.add_argument(
+        "--concurrency",
+        type=int,
+        default=CONCURRENCY,
+        help="Requests in flight per stage (the starting point with --adaptive)",
+    )
+    parser.add_argument(
+        "--adaptive",
+        action="store_true",
+        help="Grow and shrink concurrency from observed latency, errors and throughput",
+    )
+    parser.add_argument("--min-concurrency", type=int, default=MIN_CONCURRENCY)
+    parser.add_argument("--max-concurrency", type=int, default=MAX_CONCURRENCY)
+    parser.add_argument(
+        "--retry-failed",
+        action="store_true",
+        help=f"Only replay the transient failures saved in {RETRY_QUEUE}",
+    )
+    parser.add_argument(
+        "--dedupe",
+        action="store_true",
+        help=f"Keep one copy of identical media in {BLOB_DIR} and link to it",
+    )
+    parser.add_argument(
+        "--link",
+        choices=["hardlink", "reflink"],
+        default="hardlink",
+        help="How --dedupe materializes each filename (default: hardlink)",
+    )
+    parser.add_argument(
+        "--layout",
+        choices=LAYOUTS,
+        default="flat",
+        help=f"Save files directly in {OUTPUT_DIR} (flat) or in YYYY/MM/ "
+        "folders under it (date); files saved in either are not downloaded again",
+    )
+    parser.add_argument(
+        "--prometheus-textfile",
+        type=Path,
+        help="Also export metrics to this file for the node_exporter textfile collector",
+    )
+    parser.add_argument(
+        "--max-bandwidth",
+        type=parse_rate,
+        help=f"Cap on download bytes per second across all files, e.g. 2M or 500K; "
+        f'change it during a run with {{"bandwidth": ...}} in {LIMITS_FILE}',
+    )
+    parser.add_argument(
+        "--resolve-rate",
+        type=parse_rate,
+        help="Cap on link resolution requests per second to Snapchat; change it "
+        'during a run with {"resolve_rate": ...} in the same file (SIGHUP reloads it)',
+    )
+    parser.add_argument(
+        "--shard",
+        type=parse_shard,
+        help="Only download slice i of N (0-based, e.g. 2/8), keyed by filename; "
+        "each shard keeps its own checkpoint, retry queue and report",
+    )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        help="Run this many shards as local processes, then merge their results",
+    )
+    parser.add_argument(
+        "--merge-shards",
+        type=int,
+        metavar="N",
+        help="Merge the state files of N shards (e.g. run on other machines) and exit",
+    )
+    args = parser.parse_args()
+    if args.workers and args.shard:
+        parser.error("--workers starts its own shards; do not combine it with --shard")
+    return args
+
+
+async def main(args: argparse.Namespace):
+    shard = args.shard
+    # Each shard keeps its own state files; merge_shards() combines them
+    checkpoint, retry_queue, report, file_log, blob_index = (
+        shard.path(path) if shard else path
+        for path in (CHECKPOINT, RETRY_QUEUE, REPORT, FILE_LOG, BLOB_INDEX)
+    )
+    legacy = None if shard else LEGACY_CHECKPOINT
+    journal = CheckpointJournal(checkpoint, legacy_path=legacy).load()
+    journals = [journal]
+    if shard:  # files finished before the run was sharded
+        journals.append(CheckpointJournal(CHECKPOINT).load(compact=False))
+    downloaded = list_downloaded()
+    permanent = []
+    if args.retry_failed:
+        planned, permanent = load_retry_queue(retry_queue)
+        jobs = list(remaining(planned, downloaded, journals))
+        skipped = len(planned) - len(jobs)
+        total = len(jobs)
+    else:
+        manifest = load_manifest()
+        plan = functools.partial(iter_downloads, manifest, args.layout)
+        jobs = remaining(in_shard(plan(), shard), downloaded, journals)
+        total = sum(1 for _ in remaining(in_shard(plan(), shard), downloaded, journals))
+        skipped = sum(1 for _ in in_shard(plan(), shard)) - total
+
+    metrics = DownloadMetrics(args.prometheus_textfile, file_log)
+    failures = []
+    budget = ByteBudget(MAX_BUFFERED_BYTES)
+    limits = create_limiters(args)
+    rates = {
+        "bandwidth": TokenBucket("bandwidth", args.max_bandwidth),
+        "resolve_rate": TokenBucket("resolve_rate", args.resolve_rate),
+    }
+    control = RateControl(LIMITS_FILE, rates, log=tqdm.write)
+    workers = max(limiter.max_limit for limiter in limits.values())
+    # Bounded so the manifest is fed in lazily rather than all at once
+    queue = asyncio.Queue(maxsize=workers * 2)
+
+    retries = RetryScheduler(queue)
+    writer = DiskWriter(WRITER_THREADS, WRITER_QUEUE)
+    store = None
+    if args.dedupe:
+        store = BlobStore(BLOB_DIR, blob_index, link_mode=args.link).load()
+    lag = LoopLagMonitor()
+
+    async with create_session(workers) as session, journal, lag, control:
+        start_time = time.time()
+        progress = tqdm(
+            total=total,
+            desc=f"Shard {shard}" if shard else "Downloading",
+            unit="file",
+            position=shard.index if shard else None,
         )
+
+        async def producer():
+            for job in jobs:
+                retries.add()
+                job["queued_at"] = time.monotonic()
+                await queue.put(job)
+            await retries.wait_idle()
+            for _ in range(workers):
+                await queue.put(None)
+
+        async def worker():
+            while (job := await queue.get()) is not None:
+                now = time.monotonic()
+                timings = {"queue_wait": now - job.pop("queued_at", now)}
+                try:
+                    await download_one(
+                        session,
+                        limits,
+                        rates,
+                        budget,
+                        writer,
+                        journal,
+                        store,
+                        job,
+                        metrics,
+                        timings,
+                    )
+                except Exception as e:
+                    job["attempts"] = job.get("attempts", 0) + 1
+                    job["error"] = str(e) or type(e).__name__
+                    job["permanent"] = is_permanent(e)
+                    retry = not job["permanent"] and job["attempts"] < RETRIES
+                    metrics.record_error(e, final=not retry)
+                    if retry:
+                        delay = backoff_delay(
+                            job["attempts"],
+                            BACKOFF_BASE,
+                            BACKOFF_MAX,
+                            parse_retry_after(e),
+                        )
+                        retries.schedule(job, delay)
+                        continue
+                    failures.append(job)
+                progress.update(1)
+                retries.done()
+
+        sampler = asyncio.create_task(metrics.sample(limits, queue))
+        await asyncio.gather(producer(), *(worker() for _ in range(workers)))
+        sampler.cancel()
         progress.close()
 
         elapsed = time.time() - start_time
+    writer.close()
+    await metrics.close()
+    if store:
+        store.save()
 
-    mb_total = stats["mb"]
+    mb_total = metrics.bytes / (1024 * 1024)
     speed = mb_total / elapsed if elapsed > 0 else 0
 
     print("\n" + "=" * 60)
-    print(f"Downloaded: {len(tasks_to_download) - len(failures)} files")
+    if shard:
+        print(f"Shard:      {shard}")
+    print(f"Downloaded: {total - len(failures)} files")
+    print(f"Skipped:    {skipped} files already downloaded")
     print(f"Failed:     {len(failures)} files")
     print(f"Data:       {mb_total:.2f} MB")
     print(f"Speed:      {speed:.2f} MB/s")
+    for phase, label in (
+        ("resolve", "Resolve:"),
+        ("ttfb", "TTFB:"),
+        ("transfer", "Transfer:"),
+        ("write", "Write:"),
+    ):
+        h = metrics.histograms[phase]
+        if h.count:
+            print(
+                f"{label:<11} p50 {h.quantile(0.5):.3f} s, "
+                f"p99 {h.quantile(0.99):.3f} s"
+            )
+    if store:
+        saved_mb = store.bytes_saved / (1024 * 1024)
+        print(f"Duplicates: {store.duplicates} files ({saved_mb:.2f} MB not stored)")
+    print(
+        f"Loop lag:   {lag.total_lag:.2f} s blocked in total, "
+        f"{lag.max_lag * 1000:.0f} ms at worst"
+    )
     print("=" * 60)
 
     if failures:
         print("\nFailed downloads:")
-        for url, err in failures:
-            print(f" - {url}   ({err})")
+        for job in failures:
+            kind = "permanent" if job["permanent"] else "transient"
+            print(f" - {job['url']}   ({kind}: {job['error']})")
         print()
+        print("Run with --retry-failed to retry the transient failures only.")
+    save_retry_queue(retry_queue, permanent + failures)
+
+    extra = {"max_loop_lag": round(lag.max_lag, 6), "skipped": skipped}
+    if shard:
+        extra["shard"] = str(shard)
+    metrics.write_json(report, **extra)
+    if args.prometheus_textfile:
+        metrics.write_prometheus(args.prometheus_textfile)
+    print(f"Metrics written to {report}")
+
+
+def worker_argv(argv: list[str]) -> list[str]:
+    """
+    The command line for each local worker: this one without --workers.
+    """
+    result = []
+    skip = False
+    for arg in argv:
+        if skip:
+            skip = False
+        elif arg == "--workers":
+            skip = True
+        elif not arg.startswith("--workers="):
+            result.append(arg)
+    return result
+
+
+def merge(count: int) -> None:
+    report = merge_shards(
+        count, CHECKPOINT, RETRY_QUEUE, REPORT, BLOB_INDEX, file_log=FILE_LOG
+    )
+    if report is None:
+        print(f"No shard reports found for {count} shards")
+        return
+    mb_total = report["bytes"] / (1024 * 1024)
+    speed = mb_total / report["elapsed"] if report["elapsed"] > 0 else 0
+    print("\n" + "=" * 60)
+    print(f"Shards:     {len(report['shards'])} of {count} reported")
+    print(f"Downloaded: {report['files_downloaded']} files")
+    print(f"Skipped:    {report['skipped']} files already downloaded")
+    print(f"Failed:     {report['files_failed']} files")
+    print(f"Data:       {mb_total:.2f} MB")
+    print(f"Speed:      {speed:.2f} MB/s")
+    print("=" * 60)
+    print(f"Merged checkpoints, retry queues and reports into {REPORT.parent}")
 
 
 if __name__ == "__main__":
-    asyncio.run(main())
+    args = parse_args()
+    if args.workers:
+        argv = worker_argv(sys.argv[1:])
+        codes = run_local_workers(Path(__file__), argv, args.workers)
+        merge(args.workers)
+        sys.exit(max(codes))
+    elif args.merge_shards:
+        merge(args.merge_shards)
+    else:
+        asyncio.run(main(args))
@@ -0,0 +1,296 @@
+import itertools
+import os
+import queue
+import re
+import subprocess
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Callable
+
+
+EXIFTOOL = "exiftool"
+BATCH_SIZE = 64  # files per request
+TIMEOUT = 60.0  # seconds per request before the worker is restarted
+MISSING = "-"  # what exiftool -T prints for a tag a file does not have
+UPDATED = re.compile(r"\s*1 image files updated")
+SUMMARY = re.compile(r"\s*\d+ .*\bfiles?\b")  # e.g. "0 image files updated"
+
+
+class ExifToolError(RuntimeError):
+    pass
+
+
+class ExifToolProcess:
+    """
+    One long-lived `exiftool -stay_open True -@ -` process. Each request is
+    a list of arguments followed by -execute<n>, and its output ends with a
+    {ready<n>} line. Output is read on a separate thread so that a request
+    can time out; a process that times out or dies is restarted.
+    """
+
+    def __init__(self, executable: str = EXIFTOOL, stderr=subprocess.DEVNULL):
+        self.executable = executable
+        self.stderr = stderr  # subprocess.STDOUT to read errors with the output
+        self._process: subprocess.Popen | None = None
+        self._lines: queue.Queue = queue.Queue()
+        self._counter = itertools.count(1)
+
+    def start(self) -> None:
+        self._process = subprocess.Popen(
+            [self.executable, "-stay_open", "True", "-@", "-"],
+            stdin=subprocess.PIPE,
+            stdout=subprocess.PIPE,
+            stderr=self.stderr,
+            text=True,
+            encoding="utf-8",
+            errors="replace",
+        )
+        # A fresh queue, so nothing left over from a hung request is read
+        self._lines = queue.Queue()
+        threading.Thread(
+            target=self._pump, args=(self._process.stdout, self._lines), daemon=True
+        ).start()
+
+    @staticmethod
+    def _pump(stdout, lines: queue.Queue) -> None:
+        for line in stdout:
+            lines.put(line)
+        lines.put(None)  # end of output: the process exited
+
+    def execute(self, args: list[str], timeout: float = TIMEOUT) -> list[str]:
+        """
+        Run one request and return its output lines.
+        """
+        (n,) = self._send([args])
+        return self._read_output(n, timeout)
+
+    def execute_many(
+        self, requests: list[list[str]], timeout: float = TIMEOUT
+    ) -> list[list[str] | None]:
+        """
+        Send several requests in one write, each ended by its own -execute<n>,
+        and return their output lines in order. Each request may take up to
+        timeout; if one hangs or the process dies, it and the requests after
+        it get None.
+        """
+        numbers = self._send(requests)
+        outputs = []
+        for n in numbers:
+            try:
+                outputs.append(self._read_output(n, timeout))
+            except (TimeoutError, ExifToolError):
+                break
+        return outputs + [None] * (len(requests) - len(outputs))
+
+    def _send(self, requests: list[list[str]]) -> list[int]:
+        if self._process is None or self._process.poll() is not None:
+            self.start()
+        numbers = [next(self._counter) for _ in requests]
+        text = "".join(
+            "\n".join(args) + f"\n-execute{n}\n" for args, n in zip(requests, numbers)
+        )
+        try:
+            self._process.stdin.write(text)
+            self._process.stdin.flush()
+        except OSError as e:
+            self.kill()
+            raise ExifToolError(f"exiftool is not accepting requests: {e}") from e
+        return numbers
+
+    def _read_output(self, n: int, timeout: float) -> list[str]:
+        ready = f"{{ready{n}}}"
+        deadline = time.monotonic() + timeout
+        output = []
+        while True:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                self.kill()
+                raise TimeoutError(f"exiftool did not answer within {timeout:.0f} s")
+            try:
+                line = self._lines.get(timeout=remaining)
+            except queue.Empty:
+                continue
+            if line is None:
+                self.kill()
+                raise ExifToolError("exiftool exited during a request")
+            line = line.rstrip("\r\n")
+            if line == ready:
+                return output
+            output.append(line)
+
+    def kill(self) -> None:
+        if self._process is not None:
+            self._process.kill()
+            self._process.wait()
+            self._process = None
+
+    def close(self) -> None:
+        if self._process is None:
+            return
+        try:
+            self._process.stdin.write("-stay_open\nFalse\n")
+            self._process.stdin.flush()
+            self._process.wait(timeout=5)
+            self._process = None
+        except (OSError, subprocess.TimeoutExpired):
+            self.kill()
+
+
+class ExifToolPool:
+    """
+    A pool of ExifToolProcess workers, one per core by default, reading or
+    writing tags for many files in batches. A read batch that times out is
+    split in half and retried so that a single file that hangs exiftool is
+    isolated; that file, like one exiftool reports an error for, comes back
+    as None rather than as tags it does not have.
+    """
+
+    def __init__(
+        self,
+        workers: int | None = None,
+        batch_size: int = BATCH_SIZE,
+        timeout: float = TIMEOUT,
+        executable: str = EXIFTOOL,
+        stderr=subprocess.DEVNULL,
+    ):
+        self.workers = workers or os.cpu_count() or 1
+        self.batch_size = batch_size
+        self.timeout = timeout
+        self._idle: queue.Queue = queue.Queue()
+        for _ in range(self.workers):
+            self._idle.put(ExifToolProcess(executable, stderr))
+
+    def __enter__(self) -> "ExifToolPool":
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.close()
+
+    def close(self) -> None:
+        while not self._idle.empty():
+            self._idle.get().close()
+
+    def read_tags(
+        self,
+        files: list[Path],
+        tags: list[str],
+        on_done: Callable[[int], None] | None = None,
+    ) -> dict[Path, list[str] | None]:
+        """
+        Values of tags (exiftool arguments such as "-createdate") for each
+        file, formatted as `exiftool -T` prints them ("-" for a tag the file
+        does not have), or None for a file that could not be read. on_done
+        is called with the number of files in each finished batch.
+        """
+        batches = [
+            files[i : i + self.batch_size]
+            for i in range(0, len(files), self.batch_size)
+        ]
+        results = {}
+        with ThreadPoolExecutor(self.workers) as executor:
+            for batch_result, batch in zip(
+                executor.map(lambda b: self._read_batch(b, tags), batches), batches
+            ):
+                results.update(batch_result)
+                if on_done:
+                    on_done(len(batch))
+        return results
+
+    def _read_batch(self, files: list[Path], tags: list[str]) -> dict:
+        process = self._idle.get()
+        try:
+            # FilePath comes first so each output line maps back to its file
+            args = ["-T", "-charset", "filename=utf8", "-FilePath", *tags]
+            lines = process.execute(args + [str(f) for f in files], self.timeout)
+        except (TimeoutError, ExifToolError):
+            lines = None  # the worker was killed and restarts on its next request
+        finally:
+            self._idle.put(process)
+
+        if lines is None:
+            if len(files) == 1:
+                return {files[0]: None}
+            middle = len(files) // 2
+            return self._read_batch(files[:middle], tags) | self._read_batch(
+                files[middle:], tags
+            )
+
+        by_path = {os.path.realpath(f): f for f in files}
+        results = dict.fromkeys(files)  # exiftool prints no line for errors
+        for line in lines:
+            path, *values = line.split("\t")
+            if (f := by_path.get(os.path.realpath(path))) is not None:
+                results[f] = (values + [MISSING] * len(tags))[: len(tags)]
+        return results
+
+    def write_tags(
+        self,
+        jobs: dict[Path, list[str]],
+        retries: int = 1,
+        on_done: Callable[[int], None] | None = None,
+    ) -> dict[Path, str | None]:
+        """
+        Apply exiftool write arguments (such as "-GPSLatitude=40.1" and
+        "-overwrite_original") to each file, in batches of one request per
+        file spread over the workers. Returns None for each file written, or
+        the reason it was not; files that failed are tried again on fresh
+        exiftool processes, up to retries more times. on_done is called with
+        the number of files in each finished first-attempt batch.
+        """
+        results = {}
+        pending = list(jobs)
+        for attempt in range(retries + 1):
+            if attempt:
+                self._restart()
+            batches = [
+                pending[i : i + self.batch_size]
+                for i in range(0, len(pending), self.batch_size)
+            ]
+            with ThreadPoolExecutor(self.workers) as executor:
+                for batch_result, batch in zip(
+                    executor.map(lambda b: self._write_batch(b, jobs), batches),
+                    batches,
+                ):
+                    results.update(batch_result)
+                    if on_done and attempt == 0:
+                        on_done(len(batch))
+            pending = [f for f in pending if results[f] is not None]
+            if not pending:
+                break
+        return results
+
+    def _restart(self) -> None:
+        """
+        Stop every worker's exiftool; each starts a new one on its next
+        request. Only call this while no batch is running.
+        """
+        for _ in range(self.workers):
+            process = self._idle.get()
+            process.close()
+            self._idle.put(process)
+
+    def _write_batch(self, files: list[Path], jobs: dict[Path, list[str]]) -> dict:
+        requests = [["-charset", "filename=utf8", *jobs[f], str(f)] for f in files]
+        process = self._idle.get()
+        try:
+            outputs = process.execute_many(requests, self.timeout)
+        except ExifToolError:  # could not even send the batch
+            outputs = [None] * len(files)
+        finally:
+            self._idle.put(process)
+
+        results = {}
+        for f, output in zip(files, outputs):
+            if output is None:
+                results[f] = "exiftool stopped responding"
+            elif any(UPDATED.match(line) for line in output):
+                results[f] = None
+            else:
+                # What is left besides the summary counts is exiftool's message
+                message = [
+                    l.strip() for l in output if l.strip() and not SUMMARY.match(l)
+                ]
+                results[f] = " ".join(message) or " ".join(output).strip()
+        return results
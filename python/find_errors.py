@@ -1,74 +1,39 @@
+import argparse
 import pandas as pd
 import re
 import pytz
 import os
-from timezonefinder import TimezoneFinder
 from datetime import datetime, timedelta, timezone
 import subprocess
 from tqdm.asyncio import tqdm
-import json
-import string
-from pathlib import Path
 
+from coords import dms_to_degrees, split_gps_coordinates
+from manifest import load_manifest
+from tables import read_table, write_table
+from timezones import GRID, TimezoneResolver, zone
 
-OUTPUT_DIR = Path("./downloads")
-
-
-def number_to_letters(n: int) -> str:
-    """0 -> A, 25 -> Z, 26 -> AA, etc."""
-    letters = string.ascii_uppercase
-    result = ""
-    while True:
-        n, rem = divmod(n, 26)
-        result = letters[rem] + result
-        if n == 0:
-            break
-        n -= 1
-    return result
-
-
-def get_file_path(timestamp: str, index: int, url: str) -> Path:
-    dt = datetime.strptime(timestamp, "%Y-%m-%d %H:%M:%S UTC")
-    dt = dt.replace(tzinfo=pytz.utc)
-    ext = "mp4" if ".mp4" in url.lower() else "jpg"
-    suffix = f"-{number_to_letters(index)}"
-    filename = f"{dt.strftime('%Y-%m-%d_%H-%M-%S')}{suffix}.{ext}"
-    return OUTPUT_DIR / filename
-
-
-# Load original JSON
-with open("./resources/json/memories_history.json", "r") as f:
-    memories = json.load(f)["Saved Media"]
-
-# Prepare index per timestamp (deterministic order like downloader)
-timestamp_index_map = {}
-
-records = []
-for item in memories:
-    url = item.get("Download Link")
-    ts = item.get("Date")
-    if not url or not ts:
-        continue
-
-    index = timestamp_index_map.get(ts, 0)
-    timestamp_index_map[ts] = index + 1
-
-    path = get_file_path(ts, index, url)
-
-    # Add everything to a record dictionary
-    record = item.copy()
-    record["file_path"] = path
-    records.append(record)
-
-# Create DataFrame
-df = pd.DataFrame(records)
 
+parser = argparse.ArgumentParser(description="Compare downloaded files to the export.")
+parser.add_argument(
+    "--json",
+    action="store_true",
+    help="Also write needs_fix.json, for reading by eye",
+)
+parser.add_argument(
+    "--tz-grid",
+    type=float,
+    default=GRID,
+    help=f"Size in degrees of the grid timezones are looked up on (default: {GRID})",
+)
+args = parser.parse_args()
 
-def _get_filename(row: pd.Series) -> pd.Series:
-    path_parts = f"{row["file_path"]}".split("/")
-    file = path_parts[-1]
-    row["filename"] = file[0:-4]
-    return row
+# Canonical memories, in the same order and with the same names as the downloader
+df = (
+    load_manifest()
+    .to_frame()
+    .rename(columns={"timestamp": "Date", "media_type": "Media Type"})
+)
+df["filename"] = df["filename"].str.rsplit(".", n=1).str[0]
 
 
 def get_utc_datetime(row: pd.Series) -> pd.Series:
@@ -77,13 +42,10 @@ def get_utc_datetime(row: pd.Series) -> pd.Series:
 
 
 correct = df
-correct = correct.apply(_get_filename, axis=1)
 correct = correct.apply(get_utc_datetime, axis=1)
 
 
-current: pd.DataFrame = pd.read_json(
-    "./resources/temp/filemetadata.json", orient="index"
-)
+current: pd.DataFrame = read_table("filemetadata")
 current["file"] = f"./" + current["file"]
 
 
@@ -97,59 +59,6 @@ def get_filetype(row: pd.Series) -> pd.Series:
     return row
 
 
-def get_dd_from_dms(
-    coord_str: str,
-) -> float | None:  # Changes DMS string to decimal degrees
-    gps_str = coord_str
-    if gps_str == "-":
-        return None
-    try:
-        parts = (
-            gps_str.replace(" deg ", "#")
-            .replace('"', "#")
-            .replace("'", "#")
-            .replace(" ", "")
-            .split("#")
-        )
-        degrees = float(parts[0])
-        minutes = float(parts[1]) / 60.00
-        seconds = float(parts[2]) / 3600.00
-        dd_coordinate = degrees + minutes + seconds
-        if gps_str[-1] in ["W", "S"]:
-            dd_coordinate = -dd_coordinate
-        return round(dd_coordinate, 6)
-    except Exception:
-        return None
-
-
-def get_jpg_coords(row: pd.Series) -> pd.Series:
-    row["jpg_latitude"] = None
-    row["jpg_longitude"] = None
-    if row["gpslatitude"] != "-" and row["gpslongitude"] != "-":
-        row["jpg_latitude"] = get_dd_from_dms(row["gpslatitude"])
-        row["jpg_longitude"] = get_dd_from_dms(row["gpslongitude"])
-        return row
-    return row
-
-
-def get_mp4_coords(row: pd.Series) -> pd.Series:
-    row["mp4_latitude"] = None
-    row["mp4_longitude"] = None
-    row["mp4_coord_err_flag"] = True
-    if row["QuickTime:GPSCoordinates"] != "-":
-        coords = row["QuickTime:GPSCoordinates"].split(", ")
-        row["mp4_latitude"] = get_dd_from_dms(coords[0])
-        row["mp4_longitude"] = get_dd_from_dms(coords[1])
-        if coords[0] == row["gpslatitude"] and coords[1] == row["gpslongitude"]:
-            if (
-                coords[0] == row["xmp:gpslatitude"]
-                and coords[1] == row["xmp:gpslongitude"]
-            ):
-                row["mp4_coord_err_flag"] = False
-        return row
-    return row
-
-
 def get_jpg_times(row: pd.Series) -> pd.Series:
     row["jpg_utc_time"] = None
     row["jpg_local_tz"] = None
@@ -175,8 +84,23 @@ def get_mp4_times(row: pd.Series) -> pd.Series:
 
 
 current = current.apply(get_filetype, axis=1)
-current = current.apply(get_jpg_coords, axis=1)
-current = current.apply(get_mp4_coords, axis=1)
+
+# Coordinates are parsed a whole column at a time
+has_jpg_coords = (current["gpslatitude"] != "-") & (current["gpslongitude"] != "-")
+current["jpg_latitude"] = dms_to_degrees(current["gpslatitude"]).where(has_jpg_coords)
+current["jpg_longitude"] = dms_to_degrees(current["gpslongitude"]).where(has_jpg_coords)
+mp4_coords = split_gps_coordinates(current["QuickTime:GPSCoordinates"])
+current["mp4_latitude"] = dms_to_degrees(mp4_coords["latitude"])
+current["mp4_longitude"] = dms_to_degrees(mp4_coords["longitude"])
+# Only consistent when every copy of the location agrees with GPSCoordinates
+mp4_coords_agree = (
+    (mp4_coords["latitude"] == current["gpslatitude"])
+    & (mp4_coords["longitude"] == current["gpslongitude"])
+    & (mp4_coords["latitude"] == current["xmp:gpslatitude"])
+    & (mp4_coords["longitude"] == current["xmp:gpslongitude"])
+)
+current["mp4_coord_err_flag"] = ~mp4_coords_agree.fillna(False).astype(bool)
+
 current = current.apply(get_jpg_times, axis=1)
 current = current.apply(get_mp4_times, axis=1)
 
@@ -214,8 +138,7 @@ df1 = current[current_keep]
 
 
 def get_filename(row: pd.Series) -> pd.Series:
-    path_parts = row["file"].split("/")
-    file = path_parts[-1]
+    file = os.path.basename(row["file"])  # also under downloads/YYYY/MM/
     row["filename"] = file[0:-4]
     return row
 
@@ -228,14 +151,6 @@ def get_join_col(row: pd.Series) -> pd.Series:
     return row
 
 
-def extract_lat_long(row: pd.Series) -> pd.Series:
-    coordinates = row["Location"].split(": ")[1]
-    lat_str, long_str = coordinates.split(", ")
-    row["location_latitude"] = round(float(lat_str), 5)
-    row["location_longitude"] = round(float(long_str), 5)
-    return row
-
-
 keep_cols = {
     "filename": "file",
     "Media Type": "correct_filetype",
@@ -243,31 +158,30 @@ keep_cols = {
     "location_latitude": "correct_latitude",
     "location_longitude": "correct_longitude",
 }
-correct = correct.apply(extract_lat_long, axis=1)
+correct["location_latitude"] = correct["latitude"].round(5).fillna(0.0)
+correct["location_longitude"] = correct["longitude"].round(5).fillna(0.0)
 correct = correct[keep_cols.keys()].rename(columns=keep_cols)
 
 
-tf = TimezoneFinder()
+# Each distinct place is looked up once, and remembered between runs
+with TimezoneResolver(grid=args.tz_grid) as timezones:
+    tz_names = timezones.names_at(
+        correct["correct_latitude"], correct["correct_longitude"]
+    )
 
 
 def get_localized_dt_and_offset(
-    utc_dt: datetime, latitude: float, longitude: float
+    utc_dt: datetime, latitude: float, longitude: float, tz_name: str | None
 ) -> tuple[datetime, str]:
-    tz_name = tf.timezone_at(lng=longitude, lat=latitude)
-
-    utc_dt = utc_dt.astimezone(tz=pytz.utc)
-
-    utc_timezone = pytz.utc
-    central_timezone = pytz.timezone("America/Chicago")
-    mountain_timezone = pytz.timezone("America/Denver")
+    utc_dt = utc_dt.astimezone(tz=timezone.utc)
 
     if not tz_name or latitude == 0 or longitude == 0:
         # print(
         #     f"Warning: No timezone found for {utc_dt.strftime("%Y-%m-%d %H:%M:%S")} UTC. Defaulting to MDT/MST."
         # )
-        local_tz = mountain_timezone
+        local_tz = zone("America/Denver")
     else:
-        local_tz = pytz.timezone(tz_name)
+        local_tz = zone(tz_name)
 
     dt_local = utc_dt.astimezone(local_tz)
 
@@ -286,6 +200,7 @@ def get_localized_dt(row: pd.Series) -> pd.Series:
         utc_dt=row["correct_datetime_utc"],
         latitude=row["correct_latitude"],
         longitude=row["correct_longitude"],
+        tz_name=tz_names[row.name],
     )
     row["correct_datetime_local"] = local_dt
     row["correct_tz"] = dynamic_tz
@@ -402,6 +317,4 @@ print(f"Total files checked: {errors.shape[0]}")
 needs_fix = errors[errors["need_fix"]]
 
 print(f"Files with errors: {needs_fix.shape[0]}")
-needs_fix.to_json(
-    "./resources/temp/needs_fix.json", orient="index", default_handler=str, indent=4
-)
+write_table(needs_fix, "needs_fix", json_export=args.json)
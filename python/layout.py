@@ -0,0 +1,45 @@
+import os
+from pathlib import Path
+from typing import Iterator
+
+
+DOWNLOADS = Path("./downloads")
+MEDIA_SUFFIXES = (".jpg", ".mp4")
+LAYOUTS = ("flat", "date")
+
+
+def media_path(filename: str, layout: str = "flat", root: Path = DOWNLOADS) -> Path:
+    """
+    Where a planned filename (YYYY-MM-DD_HH-MM-SS-A.jpg) goes: directly in
+    root with the flat layout, or in root/YYYY/MM/ with the date layout,
+    which keeps each directory to a month of memories.
+    """
+    if layout == "date":
+        return root / filename[:4] / filename[5:7] / filename
+    return root / filename
+
+
+def scan_media(
+    root: Path = DOWNLOADS, suffixes: tuple[str, ...] = MEDIA_SUFFIXES
+) -> Iterator[os.DirEntry]:
+    """
+    Yield the media files under root in either layout, one directory at a
+    time; suffixes are given in lower case and match in any case. The type
+    of each entry comes from the directory listing itself, so no file is
+    stat'ed. Hidden entries, such as the .blobs store and partial downloads'
+    sidecars, are skipped.
+    """
+    pending = [root]
+    while pending:
+        try:
+            entries = os.scandir(pending.pop())
+        except FileNotFoundError:
+            continue
+        with entries:
+            for entry in entries:
+                if entry.name.startswith("."):
+                    continue
+                if entry.is_dir(follow_symlinks=False):
+                    pending.append(entry.path)
+                elif entry.name.lower().endswith(suffixes) and entry.is_file():
+                    yield entry
@@ -0,0 +1,253 @@
+import contextlib
+import hashlib
+import json
+import math
+import os
+import pickle
+import re
+import string
+import tempfile
+from array import array
+from pathlib import Path
+from typing import Iterator, NamedTuple
+
+MANIFEST = Path("./resources/json/memories_history.json")
+CACHE = Path("./resources/temp/manifest.cache")
+CACHE_VERSION = 1  # bump when the columns or filename rules change
+READ_SIZE = 1024 * 1024
+SAVED_MEDIA = re.compile(r'"Saved Media"\s*:\s*\[')
+TIMESTAMP = re.compile(r"\d{4}-\d\d-\d\d \d\d:\d\d:\d\d UTC")
+COLUMNS = (
+    "timestamp",
+    "index",
+    "filename",
+    "media_type",
+    "latitude",
+    "longitude",
+    "url",
+)
+
+
+class Memory(NamedTuple):
+    timestamp: str  # as in the export, "YYYY-MM-DD HH:MM:SS UTC"
+    index: int  # position among the memories saved in the same second
+    filename: str  # planned name in the downloads folder, e.g. ...-A.jpg
+    media_type: str | None
+    latitude: float | None
+    longitude: float | None
+    url: str
+
+
+def number_to_letters(n: int) -> str:
+    """
+    Convert a 0-indexed number to letters (A-Z, AA-ZZ, etc.)
+    0 -> A, 25 -> Z, 26 -> AA, 27 -> AB, ...
+    """
+    letters = string.ascii_uppercase
+    result = ""
+    while True:
+        n, rem = divmod(n, 26)
+        result = letters[rem] + result
+        if n == 0:
+            break
+        n -= 1
+    return result
+
+
+def planned_filename(timestamp: str, index: int, media_type: str | None) -> str:
+    """
+    Return a filename with format YYYY-MM-DD_HH-MM-SS-A.jpg/mp4
+    Supports multiple files per second with AA, AB, ... if needed
+    The extension follows the manifest's "Media Type", so the final name is
+    known before any request is made.
+    """
+    # Sliced rather than parsed with strptime, which dominates on big exports
+    if not TIMESTAMP.fullmatch(timestamp):
+        raise ValueError(f"Unexpected timestamp format: {timestamp!r}")
+    ext = "mp4" if media_type == "Video" else "jpg"
+    stamp = f"{timestamp[:10]}_{timestamp[11:19].replace(':', '-')}"
+    return f"{stamp}-{number_to_letters(index)}.{ext}"
+
+
+def parse_location(location: str | None) -> tuple[float, float]:
+    """
+    "Latitude, Longitude: 40.1, -111.2" -> (40.1, -111.2); NaNs when the
+    value is missing or malformed.
+    """
+    try:
+        lat_str, long_str = location.split(": ")[1].split(", ")
+        return float(lat_str), float(long_str)
+    except (AttributeError, IndexError, ValueError):
+        return math.nan, math.nan
+
+
+def iter_saved_media(path: Path) -> Iterator[dict]:
+    """
+    Yield the items of the export's "Saved Media" list one at a time, reading
+    the file in blocks rather than loading the whole document.
+    """
+    decoder = json.JSONDecoder()
+    with open(path, "r", encoding="utf-8") as f:
+        buf = ""
+        while not (match := SAVED_MEDIA.search(buf)):
+            chunk = f.read(READ_SIZE)
+            if not chunk:
+                raise ValueError(f'No "Saved Media" list in {path}')
+            buf = buf[-64:] + chunk  # the key may straddle two blocks
+        buf, pos = buf[match.end() :], 0
+
+        while True:
+            while pos < len(buf) and buf[pos] in " \t\r\n,":
+                pos += 1
+            if pos < len(buf) and buf[pos] == "]":
+                return
+            try:
+                if pos == len(buf):
+                    raise json.JSONDecodeError("Need more data", buf, pos)
+                item, pos = decoder.raw_decode(buf, pos)
+            except json.JSONDecodeError:
+                # An item cut off at the end of the block: read on
+                chunk = f.read(READ_SIZE)
+                if not chunk:
+                    raise
+                buf, pos = buf[pos:] + chunk, 0
+                continue
+            yield item
+
+
+class Manifest:
+    """
+    The parsed export, one canonical Memory per downloadable item, stored as
+    columns. The index assignment here is the one every stage shares: items
+    without a date or download link are skipped, and the rest are numbered
+    per timestamp in manifest order.
+    """
+
+    def __init__(self, columns: dict):
+        self.columns = columns
+
+    @classmethod
+    def parse(cls, path: Path) -> "Manifest":
+        columns = {name: [] for name in COLUMNS}
+        columns["index"] = array("I")
+        columns["latitude"] = array("d")
+        columns["longitude"] = array("d")
+        media_types = {}  # one shared string per media type keeps the cache small
+        timestamp_index_map = {}
+        for item in iter_saved_media(path):
+            url = item.get("Download Link")
+            ts = item.get("Date")
+            if not url or not ts:
+                continue
+
+            index = timestamp_index_map.get(ts, 0)
+            timestamp_index_map[ts] = index + 1
+            media_type = item.get("Media Type")
+            media_type = media_types.setdefault(media_type, media_type)
+            lat, lon = parse_location(item.get("Location"))
+            columns["timestamp"].append(ts)
+            columns["index"].append(index)
+            columns["filename"].append(planned_filename(ts, index, media_type))
+            columns["media_type"].append(media_type)
+            columns["latitude"].append(lat)
+            columns["longitude"].append(lon)
+            columns["url"].append(url)
+        return cls(columns)
+
+    def __len__(self) -> int:
+        return len(self.columns["url"])
+
+    def __iter__(self) -> Iterator[Memory]:
+        for row in zip(*(self.columns[name] for name in COLUMNS)):
+            ts, index, filename, media_type, lat, lon, url = row
+            yield Memory(
+                ts,
+                index,
+                filename,
+                media_type,
+                None if math.isnan(lat) else lat,
+                None if math.isnan(lon) else lon,
+                url,
+            )
+
+    def to_frame(self):
+        """
+        The manifest as a pandas DataFrame with one column per Memory field;
+        missing coordinates are NaN.
+        """
+        import pandas as pd
+
+        return pd.DataFrame({name: self.columns[name] for name in COLUMNS})
+
+
+def _fingerprint(path: Path) -> dict:
+    stat = os.stat(path)
+    return {"size": stat.st_size, "mtime_ns": stat.st_mtime_ns}
+
+
+def _sha256(path: Path) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        while block := f.read(READ_SIZE):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def _write_cache(cache: Path, source: dict, manifest: Manifest) -> None:
+    """
+    Publish a new cache, best effort. Several processes (e.g. the shards of
+    --workers) may rebuild it at once, so each writes its own temporary file;
+    if it cannot be published the caller still has the parsed manifest.
+    """
+    try:
+        cache.parent.mkdir(parents=True, exist_ok=True)
+        fd, tmp = tempfile.mkstemp(prefix=cache.name + ".", dir=cache.parent)
+    except OSError:
+        return
+    try:
+        with open(fd, "wb") as f:
+            pickle.dump(
+                {
+                    "version": CACHE_VERSION,
+                    "source": source,
+                    "columns": manifest.columns,
+                },
+                f,
+                protocol=pickle.HIGHEST_PROTOCOL,
+            )
+        os.replace(tmp, cache)
+    except OSError:
+        with contextlib.suppress(OSError):
+            os.unlink(tmp)
+
+
+def load_manifest(path: Path = MANIFEST, cache: Path = CACHE) -> Manifest:
+    """
+    Load the compiled manifest from cache, re-parsing the export only when it
+    has changed. A cache whose size and mtime match is used as it is; when
+    only the mtime differs (e.g. the export was copied again) the contents
+    are hashed, and the cache is kept if the hash still matches.
+    """
+    source = _fingerprint(path)
+    cached = None
+    try:
+        with open(cache, "rb") as f:
+            cached = pickle.load(f)
+    except (OSError, EOFError, pickle.UnpicklingError, AttributeError, ValueError):
+        pass
+
+    if cached and cached.get("version") == CACHE_VERSION:
+        old = cached["source"]
+        if (old["size"], old["mtime_ns"]) == (source["size"], source["mtime_ns"]):
+            return Manifest(cached["columns"])
+        if old["size"] == source["size"]:
+            source["sha256"] = _sha256(path)
+            if old.get("sha256") == source["sha256"]:
+                manifest = Manifest(cached["columns"])
+                _write_cache(cache, source, manifest)  # remember the new mtime
+                return manifest
+
+    manifest = Manifest.parse(path)
+    source.setdefault("sha256", _sha256(path))
+    _write_cache(cache, source, manifest)
+    return manifest
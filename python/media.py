@@ -0,0 +1,313 @@
+import os
+import struct
+import zlib
+from pathlib import Path
+from typing import BinaryIO, Callable
+
+SNIFF_BYTES = 16  # enough to recognise every format below
+
+LOCAL_HEADER = struct.Struct("<IHHHHHIIIHH")
+LOCAL_HEADER_SIG = 0x04034B50
+DESCRIPTOR_SIG = b"PK\x07\x08"
+CENTRAL_DIRECTORY_SIGS = (b"PK\x01\x02", b"PK\x05\x06", b"PK\x06\x06")
+JPEG_TAIL = 4096  # bytes searched for the EOI marker, allowing for padding
+BOX_HEADER = struct.Struct(">I4s")
+
+
+class CorruptMediaError(ValueError):
+    """
+    A downloaded file failed a structural check, e.g. a truncated body.
+    """
+
+
+def sniff_extension(head: bytes) -> str | None:
+    """
+    File extension for the media type given by the first bytes of a file:
+    jpg (JPEG SOI marker), mp4 (ISO-BMFF ftyp box), png, or zip for the
+    bundles Snapchat uses for memories saved with an overlay.
+    """
+    if head.startswith(b"\xff\xd8\xff"):
+        return "jpg"
+    if head[4:8] == b"ftyp":
+        return "mp4"
+    if head.startswith(b"\x89PNG\r\n\x1a\n"):
+        return "png"
+    if head.startswith(b"PK\x03\x04"):
+        return "zip"
+    return None
+
+
+def check_jpeg(f: BinaryIO, size: int) -> None:
+    """
+    A complete JPEG ends with an EOI marker, possibly followed by padding.
+    """
+    f.seek(max(0, size - JPEG_TAIL))
+    tail = f.read().rstrip(b"\x00")
+    if not tail.endswith(b"\xff\xd9"):
+        raise CorruptMediaError("JPEG has no end-of-image marker")
+
+
+def check_mp4(f: BinaryIO, size: int) -> None:
+    """
+    Walk the top-level boxes: they must tile the file exactly, and a playable
+    file has a moov box.
+    """
+    pos = 0
+    types = set()
+    while pos < size:
+        f.seek(pos)
+        header = f.read(16)
+        if len(header) < BOX_HEADER.size:
+            raise CorruptMediaError(f"MP4 box header cut off at byte {pos}")
+        box_size, box_type = BOX_HEADER.unpack_from(header)
+        if box_size == 1:  # 64-bit size follows the type
+            if len(header) < 16:
+                raise CorruptMediaError(f"MP4 box header cut off at byte {pos}")
+            box_size = struct.unpack_from(">Q", header, 8)[0]
+        elif box_size == 0:  # box runs to the end of the file
+            box_size = size - pos
+        if box_size < BOX_HEADER.size:
+            raise CorruptMediaError(f"Invalid MP4 box size {box_size} at byte {pos}")
+        types.add(box_type)
+        pos += box_size
+    if pos != size:
+        raise CorruptMediaError(
+            f"MP4 box runs past the end of the file ({pos} > {size})"
+        )
+    if b"moov" not in types:
+        raise CorruptMediaError("MP4 has no moov box")
+
+
+def verify_media(path: Path) -> None:
+    """
+    Run the cheap structural check for path's format, raising
+    CorruptMediaError when it fails. Formats without a check pass.
+    """
+    with path.open("rb") as f:
+        size = os.fstat(f.fileno()).st_size
+        ext = sniff_extension(f.read(SNIFF_BYTES))
+        if ext == "jpg":
+            check_jpeg(f, size)
+        elif ext == "mp4":
+            check_mp4(f, size)
+
+
+class ZipStreamExtractor:
+    """
+    Extracts a ZIP archive while it streams in, without buffering the archive
+    or needing to seek. Entries are read from their local headers, stored and
+    deflated entries (with or without data descriptors) are supported, and
+    each entry's CRC is checked. Reading stops at the central directory.
+
+    open_entry(name, head) is called with an entry's name and its first bytes
+    and returns the binary file to write the entry to.
+    """
+
+    def __init__(self, open_entry: Callable[[str, bytes], BinaryIO]):
+        self.open_entry = open_entry
+        self._buf = bytearray()
+        self._state = "header"
+        self._entry = None
+        self._finished = False
+
+    def write(self, data: bytes) -> None:
+        if self._finished:
+            return
+        self._buf += data
+        while self._step():
+            pass
+
+    def close(self) -> None:
+        if not self._finished:
+            raise zlib.error("ZIP stream ended before its central directory")
+
+    def _step(self) -> bool:
+        """
+        Consume as much of the buffer as the current state allows. Returns
+        False once more data is needed.
+        """
+        if self._state == "header":
+            return self._read_header()
+        if self._state == "data":
+            return self._read_data()
+        if self._state == "descriptor":
+            return self._read_descriptor()
+        return False
+
+    def _read_header(self) -> bool:
+        if len(self._buf) < 4:
+            return False
+        if bytes(self._buf[:4]) in CENTRAL_DIRECTORY_SIGS:
+            self._finished = True
+            self._state = "end"
+            self._buf.clear()
+            return False
+        if len(self._buf) < LOCAL_HEADER.size:
+            return False
+        sig, _, flags, method, _, _, crc, csize, _, nlen, xlen = (
+            LOCAL_HEADER.unpack_from(self._buf)
+        )
+        if sig != LOCAL_HEADER_SIG:
+            raise zlib.error("Not a ZIP local file header")
+        if flags & 0x1:
+            raise zlib.error("Encrypted ZIP entries are not supported")
+        if method not in (0, 8):
+            raise zlib.error(f"Unsupported ZIP compression method {method}")
+        has_descriptor = bool(flags & 0x8)
+        if method == 0 and has_descriptor:
+            raise zlib.error("Stored ZIP entries need their size up front")
+        start = LOCAL_HEADER.size + nlen + xlen
+        if len(self._buf) < start:
+            return False
+        name = bytes(self._buf[LOCAL_HEADER.size : LOCAL_HEADER.size + nlen])
+        del self._buf[:start]
+        self._entry = {
+            "name": name.decode("utf-8", "replace"),
+            "remaining": csize,
+            "crc": crc,
+            "actual_crc": 0,
+            "descriptor": has_descriptor,
+            "inflate": zlib.decompressobj(-15) if method == 8 else None,
+            "head": bytearray(),
+            "file": None,
+        }
+        self._state = "data"
+        return True
+
+    def _emit(self, data: bytes) -> None:
+        entry = self._entry
+        entry["actual_crc"] = zlib.crc32(data, entry["actual_crc"])
+        if entry["file"] is None:
+            entry["head"] += data
+            if len(entry["head"]) < SNIFF_BYTES:
+                return
+            data = bytes(entry["head"])
+            entry["file"] = self.open_entry(entry["name"], data)
+        entry["file"].write(data)
+
+    def _read_data(self) -> bool:
+        entry = self._entry
+        if entry["inflate"] is None:
+            take = min(entry["remaining"], len(self._buf))
+            self._emit(bytes(self._buf[:take]))
+            del self._buf[:take]
+            entry["remaining"] -= take
+            if entry["remaining"]:
+                return False
+        else:
+            data = bytes(self._buf)
+            self._buf.clear()
+            self._emit(entry["inflate"].decompress(data))
+            if not entry["inflate"].eof:
+                return False
+            self._buf += entry["inflate"].unused_data
+        if entry["descriptor"]:
+            self._state = "descriptor"
+        else:
+            self._finish_entry(entry["crc"])
+        return True
+
+    def _read_descriptor(self) -> bool:
+        if len(self._buf) < 4:
+            return False
+        size = 16 if bytes(self._buf[:4]) == DESCRIPTOR_SIG else 12
+        if len(self._buf) < size:
+            return False
+        (crc,) = struct.unpack_from("<I", self._buf, size - 12)
+        del self._buf[:size]
+        self._finish_entry(crc)
+        return True
+
+    def _finish_entry(self, crc: int) -> None:
+        entry = self._entry
+        if entry["file"] is None:  # entry shorter than SNIFF_BYTES
+            entry["file"] = self.open_entry(entry["name"], bytes(entry["head"]))
+            entry["file"].write(entry["head"])
+        entry["file"].close()
+        self._entry = None
+        self._state = "header"
+        if entry["actual_crc"] != crc:
+            raise zlib.error(f"CRC mismatch in ZIP entry {entry['name']}")
+
+
+class BundleWriter:
+    """
+    Binary sink that unpacks an overlay bundle as it streams in, next to the
+    planned path of its memory. The main media takes the planned name with
+    the extension of its actual content, the overlay becomes <name>-overlay
+    and any other entry <name>-<n>. Entries are written to temporary files
+    that commit() moves into place and abort() removes.
+    """
+
+    def __init__(self, path: Path):
+        self.path = path
+        self.main: Path | None = None
+        self._outputs: list[tuple[Path, Path]] = []
+        self._files: list[BinaryIO] = []
+        self._extractor = ZipStreamExtractor(self._open_entry)
+
+    def _open_entry(self, name: str, head: bytes) -> BinaryIO:
+        ext = sniff_extension(head) or Path(name).suffix.lstrip(".") or "bin"
+        stem = self.path.stem
+        if "overlay" in name.lower():
+            dest = self.path.with_name(f"{stem}-overlay.{ext}")
+        elif self.main is None and ext in ("jpg", "mp4"):
+            dest = self.main = self.path.with_suffix(f".{ext}")
+        else:
+            dest = self.path.with_name(f"{stem}-{len(self._outputs)}.{ext}")
+        tmp = dest.with_name(dest.name + ".part")
+        self._outputs.append((tmp, dest))
+        f = tmp.open("wb")
+        self._files.append(f)
+        return f
+
+    def write(self, data: bytes) -> None:
+        self._extractor.write(data)
+
+    def close(self) -> None:
+        for f in self._files:
+            f.close()
+
+    def commit(self) -> Path:
+        """
+        Check the archive was complete, move its entries into place and
+        return the path of the main media.
+        """
+        self._extractor.close()
+        if self.main is None:
+            raise zlib.error("Overlay bundle has no JPEG or MP4 entry")
+        for tmp, dest in self._outputs:
+            if dest == self.main:
+                verify_media(tmp)
+        for tmp, dest in self._outputs:
+            os.replace(tmp, dest)
+        return self.main
+
+    def abort(self) -> None:
+        self.close()
+        for tmp, _ in self._outputs:
+            tmp.unlink(missing_ok=True)
+
+
+def read_head(path: Path) -> bytes:
+    with path.open("rb") as f:
+        return f.read(SNIFF_BYTES)
+
+
+def extract_bundle(src: Path, path: Path) -> Path:
+    """
+    Unpack an overlay bundle that is already on disk (e.g. one whose download
+    was resumed) and remove it. Returns the path of the main media.
+    """
+    bundle = BundleWriter(path)
+    try:
+        with src.open("rb") as f:
+            while chunk := f.read(1024 * 1024):
+                bundle.write(chunk)
+        bundle.close()
+        main = bundle.commit()
+    except BaseException:
+        bundle.abort()
+        raise
+    src.unlink()
+    return main
@@ -0,0 +1,256 @@
+import asyncio
+import bisect
+import collections
+import json
+import math
+import os
+import threading
+import time
+from pathlib import Path
+
+# Upper bounds in seconds, in the style of Prometheus histograms
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 300)
+PHASES = ("queue_wait", "resolve", "ttfb", "transfer", "write", "total")
+SHARD_SUMMARY_KEYS = ("shard", "elapsed", "files_downloaded", "files_failed", "bytes")
+MAX_SAMPLES = 720  # concurrency samples kept; older ones are thinned out
+
+
+class Histogram:
+    def __init__(self, buckets: tuple = BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)  # the last one is +Inf
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value: float) -> None:
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+
+    def add(self, data: dict) -> None:
+        """
+        Add the counts of a histogram exported by to_dict().
+        """
+        for i, n in enumerate(data["buckets"].values()):
+            self.counts[i] += n
+        self.count += data["count"]
+        self.sum += data["sum"]
+
+    def quantile(self, q: float) -> float | None:
+        """
+        Estimate a quantile by interpolating inside the bucket it falls in.
+        """
+        if not self.count:
+            return None
+        rank = q * self.count
+        seen = 0
+        for i, n in enumerate(self.counts):
+            if seen + n >= rank and n:
+                lower = self.buckets[i - 1] if i else 0.0
+                upper = self.buckets[i] if i < len(self.buckets) else lower
+                return lower + (upper - lower) * (rank - seen) / n
+            seen += n
+        return self.buckets[-1]
+
+    def to_dict(self) -> dict:
+        return {
+            "count": self.count,
+            "sum": round(self.sum, 6),
+            "p50": self.quantile(0.5),
+            "p90": self.quantile(0.9),
+            "p99": self.quantile(0.99),
+            "buckets": {
+                str(le): n for le, n in zip(self.buckets + ("+Inf",), self.counts)
+            },
+        }
+
+
+class DownloadMetrics:
+    """
+    Per-file phase timings for the downloader, kept as latency histograms,
+    plus error counts by type and periodic samples of concurrency per stage.
+    Only those stay in memory, so it is the same size however large the
+    export: each file's own record is appended to file_log as a line of JSON
+    instead, in batches written off the event loop, and the samples are thinned to every other one, and taken half
+    as often, whenever MAX_SAMPLES is reached. The totals end up in a JSON
+    report and, optionally, a Prometheus textfile that is refreshed while
+    the run goes on.
+    """
+
+    def __init__(
+        self, prometheus_path: Path | None = None, file_log: Path | None = None
+    ):
+        self.started = time.monotonic()
+        self.histograms = {phase: Histogram() for phase in PHASES}
+        self.errors: collections.Counter = collections.Counter()
+        self.samples: list[dict] = []
+        self.sample_every = 1  # in intervals
+        self.downloaded = 0
+        self.bytes = 0
+        self.failed = 0
+        self.prometheus_path = prometheus_path
+        self.file_log = file_log
+        self._pending: list[str] = []
+        self._log_file = None
+        self._log_lock = threading.Lock()
+
+    def record_file(self, path: Path, timings: dict, nbytes: int) -> None:
+        self.downloaded += 1
+        self.bytes += nbytes
+        for phase, seconds in timings.items():
+            if phase in self.histograms:
+                self.histograms[phase].observe(seconds)
+        if self.file_log:
+            record = {"path": str(path), "bytes": nbytes} | {
+                phase: round(seconds, 6) for phase, seconds in timings.items()
+            }
+            self._pending.append(json.dumps(record) + "\n")
+
+    async def flush(self) -> None:
+        batch, self._pending = self._pending, []
+        if batch:
+            await asyncio.to_thread(self._append, batch)
+
+    def _append(self, batch: list[str]) -> None:
+        with self._log_lock:
+            if self._log_file is None:  # replaces the previous run's log
+                self.file_log.parent.mkdir(parents=True, exist_ok=True)
+                self._log_file = self.file_log.open("w")
+            self._log_file.writelines(batch)
+
+    async def close(self) -> None:
+        await self.flush()
+        if self.file_log:
+            await asyncio.to_thread(self._close_log)
+
+    def _close_log(self) -> None:
+        self._append([])  # still replaces the old log when nothing was downloaded
+        with self._log_lock:
+            self._log_file.close()
+
+    def record_error(self, exc: BaseException, final: bool) -> None:
+        status = getattr(exc, "status", None)
+        self.errors[f"HTTP {status}" if status else type(exc).__name__] += 1
+        if final:
+            self.failed += 1
+
+    async def sample(self, limits: dict, queue: asyncio.Queue, interval=1.0):
+        """
+        Look at in-flight requests and limits per stage every interval
+        seconds, keeping a sample every sample_every looks, writing out the
+        per-file records gathered since the last one and refreshing the
+        Prometheus textfile every 15.
+        """
+        ticks = 0
+        while True:
+            await asyncio.sleep(interval)
+            ticks += 1
+            await self.flush()
+            if ticks % self.sample_every == 0:
+                sample = {
+                    "t": round(time.monotonic() - self.started, 3),
+                    "queued": queue.qsize(),
+                }
+                for name, lim in limits.items():
+                    sample[f"{name}_in_flight"] = lim.in_flight
+                    sample[f"{name}_limit"] = int(lim.limit)
+                self.samples.append(sample)
+                if len(self.samples) >= MAX_SAMPLES:
+                    # Keep the even ticks, so the samples stay evenly spaced
+                    del self.samples[::2]
+                    self.sample_every *= 2
+            if self.prometheus_path and ticks % 15 == 0:
+                await asyncio.to_thread(self.write_prometheus, self.prometheus_path)
+
+    def report(self, **extra) -> dict:
+        return {
+            "elapsed": round(time.monotonic() - self.started, 3),
+            "files_downloaded": self.downloaded,
+            "files_failed": self.failed,
+            "bytes": self.bytes,
+            "phases": {phase: h.to_dict() for phase, h in self.histograms.items()},
+            "errors": dict(self.errors),
+            "concurrency": self.samples,
+        } | extra
+
+    def write_json(self, path: Path, **extra) -> None:
+        _write_atomic(path, json.dumps(self.report(**extra), indent=4))
+
+    def write_prometheus(self, path: Path) -> None:
+        lines = [
+            "# HELP snapchat_download_phase_seconds Time per file spent in each phase.",
+            "# TYPE snapchat_download_phase_seconds histogram",
+        ]
+        for phase, h in self.histograms.items():
+            cumulative = 0
+            for le, n in zip(h.buckets + (math.inf,), h.counts):
+                cumulative += n
+                bound = "+Inf" if le == math.inf else le
+                lines.append(
+                    f'snapchat_download_phase_seconds_bucket{{phase="{phase}",le="{bound}"}} {cumulative}'
+                )
+            lines.append(
+                f'snapchat_download_phase_seconds_sum{{phase="{phase}"}} {h.sum}'
+            )
+            lines.append(
+                f'snapchat_download_phase_seconds_count{{phase="{phase}"}} {h.count}'
+            )
+        lines += [
+            "# HELP snapchat_download_errors_total Failed attempts by error type.",
+            "# TYPE snapchat_download_errors_total counter",
+        ]
+        for kind, n in self.errors.items():
+            lines.append(f'snapchat_download_errors_total{{type="{kind}"}} {n}')
+        lines += [
+            "# TYPE snapchat_download_files_total counter",
+            f"snapchat_download_files_total {self.downloaded}",
+            "# TYPE snapchat_download_failed_total counter",
+            f"snapchat_download_failed_total {self.failed}",
+            "# TYPE snapchat_download_bytes_total counter",
+            f"snapchat_download_bytes_total {self.bytes}",
+        ]
+        if self.samples:
+            lines.append("# TYPE snapchat_download_in_flight gauge")
+            for key, value in self.samples[-1].items():
+                if key.endswith("_in_flight"):
+                    stage = key.removesuffix("_in_flight")
+                    lines.append(
+                        f'snapchat_download_in_flight{{stage="{stage}"}} {value}'
+                    )
+        _write_atomic(path, "\n".join(lines) + "\n")
+
+
+def _write_atomic(path: Path, text: str) -> None:
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp = path.with_name(path.name + ".tmp")
+    tmp.write_text(text)
+    os.replace(tmp, path)
+
+
+def merge_reports(reports: list[dict]) -> dict:
+    """
+    Combine the reports of shards that ran side by side into one. Histograms
+    and counters are summed, and the elapsed time is that of the slowest shard.
+    """
+    histograms = {phase: Histogram() for phase in PHASES}
+    errors = collections.Counter()
+    for report in reports:
+        for phase, data in report["phases"].items():
+            histograms[phase].add(data)
+        errors.update(report["errors"])
+    return {
+        "elapsed": max(r["elapsed"] for r in reports),
+        "files_downloaded": sum(r["files_downloaded"] for r in reports),
+        "files_failed": sum(r["files_failed"] for r in reports),
+        "bytes": sum(r["bytes"] for r in reports),
+        "skipped": sum(r.get("skipped", 0) for r in reports),
+        "max_loop_lag": max(r.get("max_loop_lag", 0) for r in reports),
+        "phases": {phase: h.to_dict() for phase, h in histograms.items()},
+        "errors": dict(errors),
+        "shards": [{key: r.get(key) for key in SHARD_SUMMARY_KEYS} for r in reports],
+        "concurrency": [
+            sample | {"shard": r.get("shard")}
+            for r in reports
+            for sample in r["concurrency"]
+        ],
+    }
@@ -0,0 +1,144 @@
+import asyncio
+import json
+import os
+import re
+import signal
+from pathlib import Path
+from typing import Callable
+
+POLL_INTERVAL = 0.25  # seconds between checks while waiting, so new rates apply quickly
+UNITS = {"": 1, "K": 1024, "M": 1024**2, "G": 1024**3}
+
+
+def parse_rate(value: str | float | int | None) -> float | None:
+    """
+    Parse a rate such as 500, "2.5M" or "800K" (per second, binary units).
+    None, 0 and "" mean unlimited and give None.
+    """
+    if value is None or value == "":
+        return None
+    if isinstance(value, (int, float)):
+        return float(value) or None
+    match = re.fullmatch(r"\s*([\d.]+)\s*([KMG]?)i?B?\s*", value.upper())
+    if not match:
+        raise ValueError(f"Not a rate: {value!r}")
+    return float(match[1]) * UNITS[match[2]] or None
+
+
+class TokenBucket:
+    """
+    Token bucket limiting a rate of requests or bytes per second. Tokens
+    refill at rate per second up to burst. A caller may take more than is
+    available, which leaves the bucket in debt for later callers to wait
+    out, so a single chunk larger than burst still goes through. Waiters
+    are served in order, and set_rate() takes effect for them straight away.
+    A rate of None is unlimited.
+    """
+
+    def __init__(self, name: str, rate: float | None, burst: float | None = None):
+        self.name = name
+        self._lock = asyncio.Lock()
+        self.set_rate(rate, burst)
+        self.tokens = self.burst
+
+    def set_rate(self, rate: float | None, burst: float | None = None) -> None:
+        self.rate = rate
+        # One second's worth by default, so short bursts are smoothed out
+        self.burst = burst or rate or 0.0
+        self._stamp = asyncio.get_running_loop().time()
+        if hasattr(self, "tokens"):
+            self.tokens = min(self.tokens, self.burst)
+
+    def _refill(self) -> None:
+        now = asyncio.get_running_loop().time()
+        if self.rate:
+            self.tokens = min(self.burst, self.tokens + (now - self._stamp) * self.rate)
+        self._stamp = now
+
+    async def acquire(self, n: float = 1) -> None:
+        if not self.rate:
+            return
+        async with self._lock:
+            self._refill()
+            while self.rate and self.tokens < 0:
+                await asyncio.sleep(min(-self.tokens / self.rate, POLL_INTERVAL))
+                self._refill()
+            if self.rate:
+                self.tokens -= n
+
+
+class RateControl:
+    """
+    Applies rates from a JSON control file, e.g. {"bandwidth": "2M",
+    "resolve_rate": 5}, to named buckets while a run is in progress. The file
+    is checked every interval seconds and re-read at once on SIGHUP. A key
+    set to null or 0 lifts that limit; keys that are missing keep the rate
+    given on the command line.
+    """
+
+    def __init__(
+        self,
+        path: Path,
+        buckets: dict[str, TokenBucket],
+        interval: float = 2.0,
+        log: Callable[[str], None] = print,
+    ):
+        self.path = path
+        self.buckets = buckets
+        self.interval = interval
+        self.log = log
+        self._mtime: int | None = None
+        self._reload = asyncio.Event()
+        self._task: asyncio.Task | None = None
+
+    def load(self, force: bool = False) -> None:
+        try:
+            mtime = os.stat(self.path).st_mtime_ns
+        except FileNotFoundError:
+            return
+        if mtime == self._mtime and not force:
+            return
+        self._mtime = mtime
+        try:
+            settings = json.loads(self.path.read_text())
+            rates = {
+                key: parse_rate(value)
+                for key, value in settings.items()
+                if key in self.buckets
+            }
+        except ValueError as e:
+            self.log(f"[limits] ignoring {self.path}: {e}")
+            return
+        for key, rate in rates.items():
+            bucket = self.buckets[key]
+            if rate != bucket.rate:
+                bucket.set_rate(rate)
+                shown = "unlimited" if rate is None else f"{rate:,.0f}/s"
+                self.log(f"[limits] {key} -> {shown}")
+
+    async def _watch(self) -> None:
+        while True:
+            try:
+                await asyncio.wait_for(self._reload.wait(), self.interval)
+            except asyncio.TimeoutError:
+                self.load()
+            else:
+                self._reload.clear()
+                self.load(force=True)
+
+    async def __aenter__(self) -> "RateControl":
+        self.load()
+        loop = asyncio.get_running_loop()
+        try:
+            loop.add_signal_handler(signal.SIGHUP, self._reload.set)
+        except (AttributeError, NotImplementedError, RuntimeError):
+            pass  # no SIGHUP on Windows; the file is still polled
+        self._task = asyncio.create_task(self._watch())
+        return self
+
+    async def __aexit__(self, *exc) -> None:
+        self._task.cancel()
+        try:
+            asyncio.get_running_loop().remove_signal_handler(signal.SIGHUP)
+        except (AttributeError, NotImplementedError, RuntimeError):
+            pass
@@ -0,0 +1,115 @@
+import asyncio
+import json
+import random
+import time
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
+from pathlib import Path
+
+# Responses that will not change on a retry, e.g. an expired or revoked link
+PERMANENT_STATUSES = {400, 401, 403, 404, 410}
+
+
+def is_permanent(exc: BaseException) -> bool:
+    return getattr(exc, "status", None) in PERMANENT_STATUSES
+
+
+def parse_retry_after(exc: BaseException) -> float | None:
+    """
+    Seconds requested by a Retry-After header on an HTTP error, which may be
+    either a number of seconds or an HTTP date.
+    """
+    headers = getattr(exc, "headers", None) or {}
+    value = headers.get("Retry-After")
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        when = parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    if when.tzinfo is None:
+        when = when.replace(tzinfo=timezone.utc)
+    return max(0.0, (when - datetime.now(timezone.utc)).total_seconds())
+
+
+def backoff_delay(
+    attempt: int, base: float, cap: float, retry_after: float | None = None
+) -> float:
+    """
+    Exponential backoff with full jitter, never sooner than Retry-After.
+    """
+    delay = random.uniform(0, min(cap, base * 2 ** (attempt - 1)))
+    if retry_after is not None:
+        delay = max(delay, retry_after)
+    return delay
+
+
+class RetryScheduler:
+    """
+    Tracks jobs that are still outstanding and puts failed ones back on the
+    work queue after a delay. The delay runs in its own task, so a waiting
+    retry does not occupy a worker or a concurrency slot.
+    """
+
+    def __init__(self, queue: asyncio.Queue):
+        self.queue = queue
+        self.outstanding = 0
+        self._idle = asyncio.Event()
+        self._idle.set()
+        self._timers: set[asyncio.Task] = set()
+
+    def add(self) -> None:
+        self.outstanding += 1
+        self._idle.clear()
+
+    def done(self) -> None:
+        self.outstanding -= 1
+        if self.outstanding == 0:
+            self._idle.set()
+
+    def schedule(self, job: dict, delay: float) -> None:
+        task = asyncio.create_task(self._requeue(job, delay))
+        self._timers.add(task)
+        task.add_done_callback(self._timers.discard)
+
+    async def _requeue(self, job: dict, delay: float) -> None:
+        await asyncio.sleep(delay)
+        job["queued_at"] = time.monotonic()
+        await self.queue.put(job)
+
+    async def wait_idle(self) -> None:
+        await self._idle.wait()
+
+
+def load_retry_queue(path: Path) -> tuple[list[dict], list[dict]]:
+    """
+    Jobs persisted by an earlier run, split into those that can still succeed
+    on a retry (with their attempt counts reset) and permanent failures.
+    """
+    if not path.exists():
+        return [], []
+    jobs, permanent = [], []
+    for line in path.read_text().splitlines():
+        try:
+            job = json.loads(line)
+        except ValueError:
+            continue  # torn last line
+        if job.get("permanent"):
+            permanent.append(job)
+        else:
+            job["attempts"] = 0
+            jobs.append(job)
+    return jobs, permanent
+
+
+def save_retry_queue(path: Path, failures: list[dict]) -> None:
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp = path.with_name(path.name + ".tmp")
+    with tmp.open("w") as f:
+        for job in failures:
+            f.write(json.dumps(job) + "\n")
+    tmp.replace(path)
@@ -0,0 +1,126 @@
+import json
+import shutil
+import subprocess
+import sys
+import zlib
+from pathlib import Path
+from typing import NamedTuple
+
+from checkpoint import CheckpointJournal
+from metrics import merge_reports
+from retries import load_retry_queue, save_retry_queue
+
+
+class Shard(NamedTuple):
+    """
+    One of count deterministic slices of the manifest. A memory belongs to
+    the shard given by a CRC-32 of its planned filename stem, so every
+    process (or machine) agrees on the split without coordinating, and the
+    split does not depend on the order of the manifest.
+    """
+
+    index: int
+    count: int
+
+    def __str__(self) -> str:
+        return f"{self.index}/{self.count}"
+
+    def contains(self, stem: str) -> bool:
+        return zlib.crc32(stem.encode()) % self.count == self.index
+
+    def path(self, path: Path) -> Path:
+        """
+        This shard's own copy of a state file, e.g. checkpoint.shard-2-of-8.jsonl.
+        """
+        return path.with_name(
+            f"{path.stem}.shard-{self.index}-of-{self.count}{path.suffix}"
+        )
+
+
+def parse_shard(value: str) -> Shard:
+    """
+    Parse "i/N" with 0 <= i < N.
+    """
+    try:
+        index, count = (int(part) for part in value.split("/"))
+    except ValueError:
+        raise ValueError(f"Expected i/N, got {value!r}")
+    if not 0 <= index < count:
+        raise ValueError(f"Shard index must be in 0..{count - 1}")
+    return Shard(index, count)
+
+
+def shards(count: int) -> list[Shard]:
+    return [Shard(i, count) for i in range(count)]
+
+
+def run_local_workers(script: Path, argv: list[str], count: int) -> list[int]:
+    """
+    Run script once per shard as child processes and wait for all of them.
+    Returns their exit codes.
+    """
+    processes = [
+        subprocess.Popen([sys.executable, str(script), *argv, "--shard", str(shard)])
+        for shard in shards(count)
+    ]
+    return [process.wait() for process in processes]
+
+
+def merge_shards(
+    count: int,
+    checkpoint: Path,
+    retry_queue: Path,
+    report: Path,
+    blob_index: Path | None = None,
+    file_log: Path | None = None,
+) -> dict | None:
+    """
+    Fold the state files of count shards into the unsharded ones, so that a
+    later run without --shard sees everything the shards did. Finished
+    downloads are merged into the checkpoint, failures replace the retry
+    queue, the shards' per-file logs are joined into file_log, and the shard
+    reports become one combined report, which is returned (None when no
+    shard wrote one). Shard files are left in place,
+    so the merge can be repeated.
+    """
+    journal = CheckpointJournal(checkpoint).load()
+    for shard in shards(count):
+        journal.entries.update(CheckpointJournal(shard.path(checkpoint)).load().entries)
+    journal.compact()
+
+    failures = {}
+    for shard in shards(count):
+        jobs, permanent = load_retry_queue(shard.path(retry_queue))
+        for job in permanent + jobs:
+            failures[job["path"]] = job
+    save_retry_queue(retry_queue, list(failures.values()))
+
+    if blob_index:
+        index = {}
+        for path in [blob_index] + [shard.path(blob_index) for shard in shards(count)]:
+            if path.exists():
+                index.update(json.loads(path.read_text()))
+        if index:
+            blob_index.write_text(json.dumps(index))
+
+    if file_log:
+        tmp = file_log.with_name(file_log.name + ".tmp")
+        with tmp.open("wb") as out:
+            for shard in shards(count):
+                if (path := shard.path(file_log)).exists():
+                    with path.open("rb") as f:
+                        shutil.copyfileobj(f, out)
+        tmp.replace(file_log)
+
+    reports = [
+        json.loads(path.read_text())
+        for shard in shards(count)
+        if (path := shard.path(report)).exists()
+    ]
+    if not reports:
+        return None
+    merged = merge_reports(reports)
+    tmp = report.with_name(report.name + ".tmp")
+    tmp.write_text(json.dumps(merged, indent=4))
+    tmp.replace(report)
+    return merged
@@ -0,0 +1,157 @@
+import json
+import os
+from pathlib import Path
+
+import pandas as pd
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:  # JSON Lines only
+    pa = pq = None
+
+
+TEMP = Path("./resources/temp")
+
+
+class TableWriter:
+    """
+    Writes an intermediate table (e.g. filemetadata) one chunk of rows at a
+    time, as Parquet when pyarrow is installed and as JSON Lines otherwise.
+    Column types are kept: Parquet stores them itself, and for JSON Lines
+    they go to a <name>.schema.json next to it. The table only replaces the
+    previous one when the writer is closed. With json_export, the whole table
+    is also written as the old pretty-printed <name>.json, for reading by eye.
+    """
+
+    def __init__(self, name: str, directory: Path = TEMP, json_export: bool = False):
+        self.name = name
+        self.directory = directory
+        self.json_export = json_export
+        self.path = directory / (f"{name}.parquet" if pq else f"{name}.jsonl")
+        self._tmp = self.path.with_name(self.path.name + ".tmp")
+        self._schema = None
+        self._file = None
+        self.rows = 0
+
+    def __enter__(self) -> "TableWriter":
+        return self
+
+    def __exit__(self, exc_type, *exc) -> None:
+        if exc_type is None:
+            self.close()
+        else:  # keep the previous table rather than a partial one
+            self.abort()
+
+    def write(self, df: pd.DataFrame) -> None:
+        df = _prepare(df)
+        if self._schema is None:
+            self.directory.mkdir(parents=True, exist_ok=True)
+            if pq:
+                self._schema = pa.Schema.from_pandas(df, preserve_index=False)
+                # A column that is empty in the first chunk may hold text later
+                for i, field in enumerate(self._schema):
+                    if pa.types.is_null(field.type):
+                        self._schema = self._schema.set(i, field.with_type(pa.string()))
+                self._file = pq.ParquetWriter(self._tmp, self._schema)
+            else:
+                self._schema = {
+                    column: str(dtype) for column, dtype in df.dtypes.items()
+                }
+                self._file = open(self._tmp, "w", encoding="utf-8")
+        if pq:
+            table = pa.Table.from_pandas(df, schema=self._schema, preserve_index=False)
+            self._file.write_table(table)
+        elif len(df):
+            df.to_json(
+                self._file,
+                orient="records",
+                lines=True,
+                date_format="iso",
+                date_unit="ns",
+                default_handler=str,
+            )
+        self.rows += len(df)
+
+    def close(self) -> None:
+        if self._schema is None:
+            self.write(pd.DataFrame())
+        self._file.close()
+        if not pq:
+            schema = self.directory / f"{self.name}.schema.json"
+            tmp = schema.with_name(schema.name + ".tmp")
+            tmp.write_text(json.dumps(self._schema, indent=4))
+            os.replace(tmp, schema)
+        os.replace(self._tmp, self.path)
+        if self.json_export:
+            read_table(self.name, self.directory).to_json(
+                self.directory / f"{self.name}.json",
+                orient="index",
+                default_handler=str,
+                indent=4,
+            )
+
+    def abort(self) -> None:
+        if self._file is not None:
+            self._file.close()
+            self._tmp.unlink(missing_ok=True)
+
+
+def write_table(
+    df: pd.DataFrame, name: str, directory: Path = TEMP, json_export: bool = False
+) -> Path:
+    with TableWriter(name, directory, json_export) as writer:
+        writer.write(df)
+    return writer.path
+
+
+def read_table(name: str, directory: Path = TEMP) -> pd.DataFrame:
+    """
+    Read an intermediate table back with its column types: the Parquet or
+    JSON Lines copy, or a <name>.json written before these formats existed.
+    """
+    formats = [".jsonl", ".json"]
+    if pq:
+        formats.insert(0, ".parquet")
+    for suffix in formats:
+        path = directory / f"{name}{suffix}"
+        if path.exists():
+            break
+    else:
+        raise FileNotFoundError(f"No {name} table in {directory}")
+
+    if path.suffix == ".parquet":
+        return pd.read_parquet(path)
+    if path.suffix == ".json":
+        return pd.read_json(path, orient="index")
+
+    schema = json.loads((directory / f"{name}.schema.json").read_text())
+    if path.stat().st_size == 0:
+        df = pd.DataFrame(columns=list(schema))
+    else:
+        df = pd.read_json(path, lines=True, dtype=False, convert_dates=False)
+    for column, dtype in schema.items():
+        if dtype.startswith("datetime64"):
+            # Written in UTC; astype converts back to the column's own zone
+            aware = "," in dtype
+            values = pd.to_datetime(df[column], utc=aware, format="ISO8601")
+            df[column] = values.astype(dtype)
+        elif dtype.startswith("timedelta64"):
+            df[column] = pd.to_timedelta(df[column])
+        elif dtype != "object":
+            df[column] = df[column].astype(dtype)
+    return df
+
+
+def _prepare(df: pd.DataFrame) -> pd.DataFrame:
+    """
+    Give each column one type. Columns built row by row hold Python objects;
+    those that are all timestamps, numbers, etc. become typed columns, and
+    any that still mix types are stored as text.
+    """
+    df = df.infer_objects()
+    for column in df.columns[df.dtypes == object]:
+        values = df[column]
+        if not values.map(lambda v: v is None or isinstance(v, str)).all():
+            df[column] = values.map(lambda v: None if pd.isna(v) else str(v))
+    return df
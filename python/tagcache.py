@@ -0,0 +1,53 @@
+import json
+import os
+from pathlib import Path
+
+
+class TagCache:
+    """
+    Tag values read from each file, kept between runs so that only new or
+    changed files need exiftool. An entry is valid while the file's path,
+    size, mtime and inode all match; rewriting a file (as exiftool
+    -overwrite_original does) changes at least one of them. The whole cache
+    is dropped when the list of tags it was built for changes.
+    """
+
+    def __init__(self, path: Path, tags: list[str]):
+        self.path = path
+        self.tags = tags
+        self.entries: dict[str, dict] = {}
+
+    def load(self) -> "TagCache":
+        try:
+            data = json.loads(self.path.read_text())
+        except (OSError, ValueError):
+            return self
+        if data.get("tags") == self.tags:
+            self.entries = data.get("files", {})
+        return self
+
+    def save(self) -> None:
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        tmp = self.path.with_name(self.path.name + ".tmp")
+        tmp.write_text(json.dumps({"tags": self.tags, "files": self.entries}))
+        os.replace(tmp, self.path)
+
+    @staticmethod
+    def _identity(stat: os.stat_result) -> list[int]:
+        return [stat.st_size, stat.st_mtime_ns, stat.st_ino]
+
+    def get(self, file: Path, stat: os.stat_result) -> list[str] | None:
+        entry = self.entries.get(str(file))
+        if entry and entry["identity"] == self._identity(stat):
+            return entry["values"]
+        return None
+
+    def put(self, file: Path, stat: os.stat_result, values: list[str]) -> None:
+        self.entries[str(file)] = {"identity": self._identity(stat), "values": values}
+
+    def prune(self, files: list[Path]) -> None:
+        """
+        Forget files that are no longer on disk.
+        """
+        keep = {str(f) for f in files}
+        self.entries = {k: v for k, v in self.entries.items() if k in keep}
@@ -0,0 +1,409 @@
+import mmap
+import re
+import struct
+from datetime import datetime, timedelta
+from pathlib import Path
+
+import piexif
+
+from exiftool import MISSING
+
+
+QUICKTIME_EPOCH = datetime(1904, 1, 1)
+XMP_UUID = bytes.fromhex("BE7ACFCB97A942E89C71999491E3AFAC")
+ISO6709 = re.compile(
+    r"([-+]\d{1,2}(?:\.\d*)?)([-+]\d{1,3}(?:\.\d*)?)([-+]\d+(?:\.\d*)?)?"
+)
+XMP_DATE = re.compile(r"(\d{4})-(\d{2})-(\d{2})T(\d{2}:\d{2})(:\d+)?(\S*)")
+XMP_NUMBER = re.compile(r"[+-]?(?=\d|\.\d)\d*(?:\.\d*)?(?:[Ee][+-]\d+)?")
+# XMP properties that would also answer an ungrouped tag we are asked for
+XMP_CONFLICTS = re.compile(
+    rb"\b(?:xmp|exif|photoshop):(?:CreateDate|OffsetTimeOriginal)\b"
+)
+XMP_GPS = {
+    axis: re.compile(
+        rb"exif:GPS" + axis.title().encode() + rb"(?:=[\"']([^\"']*)|>([^<]*))"
+    )
+    for axis in ("latitude", "longitude")
+}
+# (axis, direction of positive values, EXIF Ref tag, EXIF value tag)
+GPS_AXES = (
+    ("latitude", "N", piexif.GPSIFD.GPSLatitudeRef, piexif.GPSIFD.GPSLatitude),
+    ("longitude", "E", piexif.GPSIFD.GPSLongitudeRef, piexif.GPSIFD.GPSLongitude),
+)
+SUPPORTED = {
+    "-createdate",
+    "-gpslatitude",
+    "-gpslongitude",
+    "-ifd0:datetime",
+    "-exififd:datetimeoriginal",
+    "-exififd:datetimedigitized",
+    "-offsettimeoriginal",
+    "-gpslatituderef",
+    "-gpslongituderef",
+    "-quicktime:creationdate",
+    "-quicktime:trackcreatedate",
+    "-quicktime:mediacreatedate",
+    "-quicktime:timezone",
+    "-quicktime:gpscoordinates",
+    "-xmp:gpslatitude",
+    "-xmp:gpslongitude",
+    "-quicktime:locationlatitude",
+    "-quicktime:locationlongitude",
+}
+# Keys and ItemList entries that answer one of SUPPORTED
+META_KEYS = {
+    "com.apple.quicktime.creationdate": "-quicktime:creationdate",
+    "com.apple.quicktime.location.ISO6709": "-quicktime:gpscoordinates",
+    "\xa9xyz": "-quicktime:gpscoordinates",
+}
+REFS = {"N": "North", "S": "South", "E": "East", "W": "West"}
+
+
+class Unsupported(Exception):
+    """
+    The file holds something this reader does not model, so exiftool should
+    read it instead.
+    """
+
+
+def read_tags(file: Path, tags: list[str]) -> list[str] | None:
+    """
+    Values of tags for one file, formatted as `exiftool -T` prints them, read
+    in-process from the file's header only: the EXIF and XMP segments of a
+    JPEG, or the moov box of an MP4. Returns None when a tag or the file is
+    not supported here; the caller should ask exiftool instead.
+    """
+    if any(tag.lower() not in SUPPORTED for tag in tags):
+        return None
+    try:
+        with open(file, "rb") as f, mmap.mmap(
+            f.fileno(), 0, access=mmap.ACCESS_READ
+        ) as data:
+            if data[:2] == b"\xff\xd8":
+                values = _read_jpeg(data)
+            elif data[4:8] == b"ftyp":
+                values = _read_mp4(data)
+            else:
+                return None
+    except (OSError, ValueError, struct.error, Unsupported):
+        return None  # includes empty files, which cannot be mapped
+    return [values.get(tag.lower(), MISSING) for tag in tags]
+
+
+def _read_jpeg(data: mmap.mmap) -> dict[str, str]:
+    exif = xmp = None
+    pos = 2
+    while pos + 4 <= len(data):
+        if data[pos] != 0xFF:
+            raise Unsupported("JPEG segments out of sync")
+        marker = data[pos + 1]
+        if marker == 0xFF:  # fill byte
+            pos += 1
+            continue
+        if marker in (0xDA, 0xD9):  # start of scan or end of image: no more metadata
+            break
+        if marker == 0x01 or 0xD0 <= marker <= 0xD7:  # no length
+            pos += 2
+            continue
+        (length,) = struct.unpack_from(">H", data, pos + 2)
+        if length < 2:
+            raise Unsupported("malformed JPEG segment")
+        segment = data[pos + 4 : pos + 2 + length]
+        if marker == 0xE1 and segment.startswith(b"Exif\x00\x00"):
+            if exif is not None:
+                raise Unsupported("more than one EXIF segment")
+            exif = segment[6:]
+        elif marker == 0xE1 and segment.startswith(b"http://ns.adobe.com/xap/1.0/\x00"):
+            if xmp is not None:
+                raise Unsupported("more than one XMP segment")
+            xmp = segment[29:]
+        pos += 2 + length
+
+    values = {}
+    if exif is not None:
+        ifds = piexif.load(exif)
+        ifd0, exif_ifd, gps = ifds["0th"], ifds["Exif"], ifds["GPS"]
+        _set(values, "-ifd0:datetime", _ascii(ifd0.get(piexif.ImageIFD.DateTime)))
+        _set(
+            values,
+            "-exififd:datetimeoriginal",
+            _ascii(exif_ifd.get(piexif.ExifIFD.DateTimeOriginal)),
+        )
+        created = _ascii(exif_ifd.get(piexif.ExifIFD.DateTimeDigitized))
+        _set(values, "-exififd:datetimedigitized", created)
+        _set(values, "-createdate", created)  # EXIF calls DateTimeDigitized CreateDate
+        _set(
+            values,
+            "-offsettimeoriginal",
+            _ascii(exif_ifd.get(piexif.ExifIFD.OffsetTimeOriginal)),
+        )
+        for axis, positive, ref_key, key in GPS_AXES:
+            ref = _ascii(gps.get(ref_key))
+            _set(values, f"-gps{axis}ref", REFS.get(ref, ref) if ref else None)
+            if key in gps:
+                degrees = _rational_degrees(gps[key])
+                if ref:  # the Composite tag, which includes the direction
+                    sign = -1 if ref.upper().startswith(("S", "W")) else 1
+                    _set(values, f"-gps{axis}", _dms(sign * degrees, positive))
+                else:
+                    _set(values, f"-gps{axis}", _dms(degrees))
+    if xmp is not None:
+        _read_xmp(values, bytes(xmp))
+    return values
+
+
+def _read_mp4(data: mmap.mmap) -> dict[str, str]:
+    values = {}
+    xmp = []
+    moov = None
+    for kind, start, end in _boxes(data, 0, len(data)):
+        if kind == b"moov":
+            moov = (start, end)
+        elif kind == b"uuid" and data[start : start + 16] == XMP_UUID:
+            xmp.append(data[start + 16 : end])
+    if moov is None:
+        raise Unsupported("no moov box")
+
+    track_dates, media_dates = set(), set()
+    coordinates = set()
+    for kind, start, end in _boxes(data, *moov):
+        if kind == b"mvhd":
+            _set(values, "-createdate", _quicktime_date(data, start))
+        elif kind == b"trak":
+            for child, child_start, child_end in _boxes(data, start, end):
+                if child == b"meta":
+                    raise Unsupported("track-level metadata")
+                elif child == b"udta":
+                    for item, _, _ in _boxes(data, child_start, child_end):
+                        if item in (b"meta", b"\xa9xyz", b"XMP_"):
+                            raise Unsupported("track-level metadata")
+                elif child == b"tkhd":
+                    track_dates.add(_quicktime_date(data, child_start))
+                elif child == b"mdia":
+                    for media, media_start, _ in _boxes(data, child_start, child_end):
+                        if media == b"mdhd":
+                            media_dates.add(_quicktime_date(data, media_start))
+        elif kind == b"udta":
+            for child, child_start, child_end in _boxes(data, start, end):
+                if child == b"\xa9xyz":
+                    (length,) = struct.unpack_from(">H", data, child_start)
+                    text = data[child_start + 4 : child_start + 4 + length]
+                    coordinates.add(_text(text))
+                elif child == b"XMP_":
+                    xmp.append(data[child_start:child_end])
+                elif child == b"meta":
+                    _read_meta(values, coordinates, data, child_start, child_end)
+        elif kind == b"meta":
+            _read_meta(values, coordinates, data, start, end)
+
+    # Tracks share one ungrouped tag; only report it when they agree
+    for tag, dates in (
+        ("-quicktime:trackcreatedate", track_dates),
+        ("-quicktime:mediacreatedate", media_dates),
+    ):
+        if len(dates) > 1:
+            raise Unsupported(f"tracks disagree on {tag}")
+        _set(values, tag, next(iter(dates), None))
+    if len(coordinates) > 1:
+        raise Unsupported("more than one location")
+    if coordinates:
+        match = ISO6709.match(coordinates.pop())
+        if not match:
+            raise Unsupported("location is not in decimal ISO 6709 form")
+        lat, lon = float(match[1]), float(match[2])
+        printed = [_dms(lat, "N"), _dms(lon, "E")]
+        if match[3] is not None:
+            alt = float(match[3])
+            side = "Below" if alt < 0 else "Above"
+            printed.append(f"{abs(alt):.15g} m {side} Sea Level")
+        _set(values, "-quicktime:gpscoordinates", ", ".join(printed))
+        # The Composite GPSLatitude/GPSLongitude are derived from it
+        _set(values, "-gpslatitude", printed[0])
+        _set(values, "-gpslongitude", printed[1])
+    if len(xmp) > 1:
+        raise Unsupported("more than one XMP packet")
+    if xmp:
+        _read_xmp(values, bytes(xmp[0]))
+    return values
+
+
+def _read_meta(
+    values: dict[str, str], coordinates: set, data: mmap.mmap, start: int, end: int
+) -> None:
+    for key, value in _meta(data, start, end):
+        if key not in META_KEYS:
+            continue
+        if value is None:
+            raise Unsupported(f"{key} is not text")
+        if META_KEYS[key] == "-quicktime:creationdate":
+            _set(values, "-quicktime:creationdate", _xmp_date(value))
+        else:
+            coordinates.add(value)
+
+
+def _read_xmp(values: dict[str, str], packet: bytes) -> None:
+    if XMP_CONFLICTS.search(packet):
+        raise Unsupported("XMP holds a date tag read elsewhere")
+    for axis, positive, _, _ in GPS_AXES:
+        if match := XMP_GPS[axis].search(packet):
+            raw = (match[1] if match[1] is not None else match[2]).decode()
+            printed = _dms(_xmp_degrees(raw), positive)
+            _set(values, f"-xmp:gps{axis}", printed)
+            # Also a candidate for the ungrouped tag, which must then agree
+            if values.get(f"-gps{axis}", printed) != printed:
+                raise Unsupported(f"EXIF and XMP disagree on GPS{axis}")
+            values[f"-gps{axis}"] = printed
+
+
+def _boxes(data: mmap.mmap, start: int, end: int):
+    """
+    Yield (type, content start, content end) for the boxes in data[start:end].
+    """
+    pos = start
+    while pos + 8 <= end:
+        size, kind = struct.unpack_from(">I4s", data, pos)
+        header = 8
+        if size == 1:
+            (size,) = struct.unpack_from(">Q", data, pos + 8)
+            header = 16
+        elif size == 0:
+            size = end - pos
+        if size < header or pos + size > end:
+            raise Unsupported(f"malformed {kind!r} box")
+        yield kind, pos + header, pos + size
+        pos += size
+
+
+def _meta(data: mmap.mmap, start: int, end: int):
+    """
+    Yield (key, text value) from a QuickTime `meta` box: with an mdta handler
+    item n of the ilst box holds the value of entry n of the keys box, and
+    with an mdir handler (an ItemList) each item is named by its own type,
+    e.g. "\xa9xyz". The value is None when it is not text. Any other kind of
+    meta box is not modeled.
+    """
+    if data[start + 4 : start + 8] != b"hdlr":
+        start += 4  # written as a full box, with version and flags
+    children = {kind: (s, e) for kind, s, e in _boxes(data, start, end)}
+    if b"hdlr" not in children:
+        raise Unsupported("meta box without a handler")
+    hdlr_start, _ = children[b"hdlr"]
+    handler = data[hdlr_start + 8 : hdlr_start + 12]
+    if handler not in (b"mdta", b"mdir"):
+        raise Unsupported(f"meta box with a {handler!r} handler")
+    if b"ilst" not in children:
+        return
+    names = None
+    if handler == b"mdta":
+        if b"keys" not in children:
+            raise Unsupported("mdta meta box without keys")
+        keys_start, keys_end = children[b"keys"]
+        (count,) = struct.unpack_from(">I", data, keys_start + 4)
+        names, pos = [], keys_start + 8
+        for _ in range(count):
+            (size,) = struct.unpack_from(">I", data, pos)
+            if size < 8 or pos + size > keys_end:
+                raise Unsupported("malformed keys box")
+            names.append(_text(data[pos + 8 : pos + size]))
+            pos += size
+    for kind, item_start, item_end in _boxes(data, *children[b"ilst"]):
+        if names is None:
+            key = kind.decode("latin-1")
+        else:
+            (index,) = struct.unpack(">I", kind)
+            if not 1 <= index <= len(names):
+                raise Unsupported("ilst item without a key")
+            key = names[index - 1]
+        for kind, start, end in _boxes(data, item_start, item_end):
+            if kind == b"data":
+                (well_known,) = struct.unpack_from(">I", data, start)
+                if well_known == 1:  # UTF-8 text, which is all we read
+                    yield key, _text(data[start + 8 : end])
+                else:
+                    yield key, None
+
+
+def _set(values: dict[str, str], tag: str, value: str | None) -> None:
+    if value is not None:
+        values[tag] = value
+
+
+def _text(raw: bytes) -> str:
+    return raw.rstrip(b"\x00").decode("utf-8", errors="replace")
+
+
+def _ascii(raw: bytes | None) -> str | None:
+    return None if raw is None else _text(raw).strip()
+
+
+def _quicktime_date(data: mmap.mmap, start: int) -> str:
+    """
+    The creation time of an mvhd, tkhd or mdhd box, as exiftool prints it
+    without the QuickTimeUTC option.
+    """
+    if data[start] == 1:
+        (seconds,) = struct.unpack_from(">Q", data, start + 4)
+    else:
+        (seconds,) = struct.unpack_from(">I", data, start + 4)
+    if seconds == 0:
+        return "0000:00:00 00:00:00"
+    moment = QUICKTIME_EPOCH + timedelta(seconds=seconds)
+    if moment.year < 1970:
+        raise Unsupported("creation time before 1970")
+    return moment.strftime("%Y:%m:%d %H:%M:%S")
+
+
+def _xmp_date(value: str) -> str:
+    """
+    "2023-01-16T10:07:00+01:00" -> "2023:01:16 10:07:00+01:00"
+    """
+    match = XMP_DATE.fullmatch(value)
+    if not match:
+        return value
+    return f"{match[1]}:{match[2]}:{match[3]} {match[4]}{match[5] or ''}{match[6]}"
+
+
+def _rational_degrees(parts: tuple) -> float:
+    numbers = []
+    for numerator, denominator in parts:
+        if denominator == 0:
+            raise Unsupported("zero denominator in GPS coordinate")
+        numbers.append(float(f"{numerator / denominator:.10g}"))
+    d, m, s = (numbers + [0.0, 0.0])[:3]
+    return d + (m + s / 60) / 60
+
+
+def _xmp_degrees(raw: str) -> float:
+    """
+    "40,26.7717N" -> 40.446195
+    """
+    numbers = [float(n) for n in XMP_NUMBER.findall(raw)]
+    if not numbers:
+        raise Unsupported(f"unreadable XMP coordinate {raw!r}")
+    d, m, s = (numbers + [0.0, 0.0])[:3]
+    degrees = d + (m + s / 60) / 60
+    return -degrees if raw.rstrip()[-1:].upper() in ("S", "W") else degrees
+
+
+def _dms(value: float, positive: str = "") -> str:
+    """
+    Decimal degrees in exiftool's default coordinate format:
+    40.446195, "N" -> 40 deg 26' 46.30" N. Without a direction the sign is
+    dropped, as exiftool does for a GPS value without its Ref tag.
+    """
+    ref = ""
+    if positive:
+        negative = {"N": "S", "E": "W"}[positive]
+        ref = f" {negative if value < 0 else positive}"
+    value = abs(value)
+    d = int(value)
+    m = int((value - d) * 60)
+    s = (value - d - m / 60) * 3600
+    if round(s, 2) >= 60:  # printed as 60.00: carry into the minutes
+        s = 0.0
+        m += 1
+        if m >= 60:
+            m -= 60
+            d += 1
+    return f"{d} deg {m}' {s:.2f}\"{ref}"
@@ -0,0 +1,116 @@
+import json
+import math
+import os
+from collections import OrderedDict
+from functools import lru_cache
+from importlib.metadata import version
+from pathlib import Path
+from zoneinfo import ZoneInfo
+
+import numpy as np
+import pandas as pd
+from timezonefinder import TimezoneFinder
+
+
+TZ_CACHE = Path("./resources/temp/timezone_cache.json")
+GRID = 0.001  # degrees, about 110 m of latitude
+
+
+@lru_cache(maxsize=None)
+def zone(name: str) -> ZoneInfo:
+    return ZoneInfo(name)
+
+
+class TimezoneResolver:
+    """
+    Timezone names for coordinates, looked up once per cell of a grid of
+    the given size in degrees. Memories are taken in the same few places
+    over and over, so nearly every lookup after the first in a cell is a
+    hit. At most maxsize cells are kept, least recently used first out;
+    with a path they are also kept between runs. A cell is looked up at its
+    centre, so a grid much coarser than the default can misplace points
+    near a border.
+    """
+
+    def __init__(
+        self, grid: float = GRID, path: Path | None = TZ_CACHE, maxsize: int = 100_000
+    ):
+        self.grid = grid
+        self.path = path
+        self.maxsize = maxsize
+        self.cells: OrderedDict[tuple[int, int], str | None] = OrderedDict()
+        self._finder = None
+
+    def _key(self) -> dict:
+        return {"grid": self.grid, "timezonefinder": version("timezonefinder")}
+
+    def load(self) -> "TimezoneResolver":
+        try:
+            data = json.loads(self.path.read_text())
+        except (OSError, TypeError, ValueError):
+            return self
+        if data.get("key") == self._key():
+            for cell, name in data.get("cells", []):
+                self._remember(tuple(cell), name)
+        return self
+
+    def save(self) -> None:
+        if self.path is None:
+            return
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        tmp = self.path.with_name(self.path.name + ".tmp")
+        cells = [[list(cell), name] for cell, name in self.cells.items()]
+        tmp.write_text(json.dumps({"key": self._key(), "cells": cells}))
+        os.replace(tmp, self.path)
+
+    def __enter__(self) -> "TimezoneResolver":
+        return self.load()
+
+    def __exit__(self, *exc) -> None:
+        self.save()
+
+    def _remember(self, cell: tuple[int, int], name: str | None) -> None:
+        self.cells[cell] = name
+        self.cells.move_to_end(cell)
+        if len(self.cells) > self.maxsize:
+            self.cells.popitem(last=False)
+
+    def _lookup(self, cell: tuple[int, int]) -> str | None:
+        if cell in self.cells:
+            self.cells.move_to_end(cell)
+            return self.cells[cell]
+        if self._finder is None:  # slow to build, and not needed on a warm cache
+            self._finder = TimezoneFinder()
+        lat, lng = cell[0] * self.grid, cell[1] * self.grid
+        name = self._finder.timezone_at(lng=lng, lat=lat)
+        self._remember(cell, name)
+        return name
+
+    def name_at(self, latitude: float, longitude: float) -> str | None:
+        """
+        The IANA name of the timezone at a point, or None if there is none.
+        """
+        if math.isnan(latitude) or math.isnan(longitude):
+            return None
+        cell = (round(latitude / self.grid), round(longitude / self.grid))
+        return self._lookup(cell)
+
+    def zone_at(self, latitude: float, longitude: float) -> ZoneInfo | None:
+        name = self.name_at(latitude, longitude)
+        return zone(name) if name else None
+
+    def names_at(self, latitudes: pd.Series, longitudes: pd.Series) -> pd.Series:
+        """
+        The timezone name for each point of two columns, looking up each
+        distinct cell once; None where there is none.
+        """
+        lat = np.round(latitudes.to_numpy(dtype=float) / self.grid)
+        lng = np.round(longitudes.to_numpy(dtype=float) / self.grid)
+        valid = ~(np.isnan(lat) | np.isnan(lng))
+        cells = list(
+            zip(lat[valid].astype(int).tolist(), lng[valid].astype(int).tolist())
+        )
+        names = {cell: self._lookup(cell) for cell in dict.fromkeys(cells)}
+        result = np.full(len(lat), None, dtype=object)
+        result[valid] = [names[cell] for cell in cells]
+        return pd.Series(result, index=latitudes.index, dtype=object)
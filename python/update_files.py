@@ -1,99 +1,55 @@
-import json
+import argparse
 import os
 import pandas as pd
 import pytz
-import re
-import string
 import subprocess
 from datetime import datetime
-from timezonefinder import TimezoneFinder
+from pathlib import Path
 from tqdm.asyncio import tqdm
 
+from checkpoint import CHECKPOINT, CheckpointJournal
+from coords import dms_to_degrees
+from exiftool import ExifToolPool
+from manifest import load_manifest
+from media import read_head, sniff_extension
+from tables import read_table
+from timezones import GRID, TimezoneResolver, zone
 
-def number_to_letters(n: int) -> str:
-    """0 -> A, 25 -> Z, 26 -> AA, etc."""
-    letters = string.ascii_uppercase
-    result = ""
-    while True:
-        n, rem = divmod(n, 26)
-        result = letters[rem] + result
-        if n == 0:
-            break
-        n -= 1
-    return result
 
-
-with open("./resources/json/memories_history.json", "r") as f:
-    memories = json.load(f)["Saved Media"]
-
-df = pd.DataFrame(memories)
-df["Date"] = pd.to_datetime(df["Date"], format="%Y-%m-%d %H:%M:%S UTC", utc=True)
-
-
-timestamp_counter = {}
-
-
-def get_join_col(row: pd.Series) -> pd.Series:
-    ts_str = row["Date"].strftime("%Y-%m-%d_%H-%M-%S")
-
-    index = timestamp_counter.get(ts_str, 0)
-    timestamp_counter[ts_str] = index + 1
-
-    suffix = number_to_letters(index)
-    row["file_dt"] = f"{ts_str}-{suffix}"
-    return row
-
-
-def extract_lat_long(row: pd.Series) -> pd.Series:
-    coordinates = row["Location"].split(": ")[1]
-    lat_str, long_str = coordinates.split(", ")
-    row["location_latitude"] = round(float(lat_str), 5)
-    row["location_longitude"] = round(float(long_str), 5)
-    return row
-
-
-df = df.apply(get_join_col, axis=1)
-df = df.apply(extract_lat_long, axis=1)
+parser = argparse.ArgumentParser(description="Fix the type and metadata of downloads.")
+parser.add_argument(
+    "--workers",
+    type=int,
+    help="exiftool processes writing in parallel (default: one per core)",
+)
+parser.add_argument(
+    "--tz-grid",
+    type=float,
+    default=GRID,
+    help=f"Size in degrees of the grid timezones are looked up on (default: {GRID})",
+)
+args = parser.parse_args()
+
+manifest = load_manifest().to_frame()
+df = pd.DataFrame(
+    {
+        "Date": pd.to_datetime(
+            manifest["timestamp"], format="%Y-%m-%d %H:%M:%S UTC", utc=True
+        ),
+        "Media Type": manifest["media_type"],
+        # name is YYYY-MM-DD_HH-MM-SS-A, the file's name without its extension
+        "file_dt": manifest["filename"].str.rsplit(".", n=1).str[0],
+        "location_latitude": manifest["latitude"].round(5).fillna(0.0),
+        "location_longitude": manifest["longitude"].round(5).fillna(0.0),
+    }
+)
 
 
-metadata = pd.read_json("./resources/temp/filemetadata.json", orient="index")
+metadata = read_table("filemetadata")
 metadata["file"] = f"./" + metadata["file"]
 metadata.reset_index(drop=True, inplace=True)
 
 
-def convert_lat_long_to_decimal_degrees(row: pd.Series) -> pd.Series:
-    def dms_to_decimal(dms_string):
-        match = re.search(
-            r"(\d+)\s*deg\s*(\d+)'\s*([\d.]+)\"\s*([NSEW])", dms_string, re.IGNORECASE
-        )
-        if not match:
-            raise ValueError(f"Coordinate format not recognized: {dms_string}")
-
-        degrees = float(match.group(1))
-        minutes = float(match.group(2))
-        seconds = float(match.group(3))
-        direction = match.group(4).upper()
-        decimal_degrees = degrees + (minutes / 60) + (seconds / 3600)
-        if direction in ["S", "W"]:
-            decimal_degrees *= -1
-        decimal_degrees = round(decimal_degrees, 5)
-        return decimal_degrees
-
-    def convert(value: str) -> float:
-        if pd.isna(value):
-            return 0.0
-        if value == "-":
-            return 0.0
-        try:
-            return dms_to_decimal(value)
-        except ValueError:
-            return 0.0
-
-    row["Latitude"] = convert(row["gpslatitude"])
-    row["Longitude"] = convert(row["gpslongitude"])
-    return row
-
-
 def get_file_name(row: pd.Series) -> pd.Series:
     file = os.path.basename(row["file"])
     name, ext = os.path.splitext(file)
@@ -107,7 +63,10 @@ def get_file_name(row: pd.Series) -> pd.Series:
     return row
 
 
-meta = metadata.apply(convert_lat_long_to_decimal_degrees, axis=1)
+meta = metadata.assign(
+    Latitude=dms_to_degrees(metadata["gpslatitude"], 5, require_direction=True),
+    Longitude=dms_to_degrees(metadata["gpslongitude"], 5, require_direction=True),
+).fillna({"Latitude": 0.0, "Longitude": 0.0})
 meta = meta.apply(get_file_name, axis=1)
 
 
@@ -198,57 +157,60 @@ video_errors = errors[errors["correct_media_type"] == "Video"]
 print(f"Video errors: {video_errors.shape[0]}")
 
 
+MEDIA_TYPES = {"jpg": "Image", "mp4": "Video"}  # by sniffed extension
+renamed = {}
+
+
 def fix_filetype(row: pd.Series) -> pd.Series:
+    """
+    Files saved by versions that took the extension from the URL can carry
+    the wrong one. Rename those after their content, which the downloader
+    now sniffs before saving, so files it saved are left as they are.
+    """
+    if pd.isna(row["path"]) or row["path"] == "-":
+        return row
+    path = Path(row["path"])
     try:
-        if pd.isna(row["path"]) or row["path"] == "-":
-            return row
-
-        mp4_file_path = f"./downloads/{row['filename'][:-4]}.mp4"
-        jpg_file_path = f"./downloads/{row['filename'][:-4]}.jpg"
-
-        if row["correct_media_type"] == row["actual_media_type"]:
-            return row
-
-        if row["path"] == "-":
-            return row
-
-        if row["correct_media_type"] == "Image":
-            os.rename(src=mp4_file_path, dst=jpg_file_path)
-            if os.path.exists(jpg_file_path):
-                row["filename"] = f"{row['filename'][:-4]}.jpg"
-                row["actual_media_type"] = "Image"
-        elif row["correct_media_type"] == "Video":
-            os.rename(src=jpg_file_path, dst=mp4_file_path)
-            if os.path.exists(mp4_file_path):
-                row["filename"] = f"{row['filename'][:-4]}.mp4"
-                row["actual_media_type"] = "Video"
+        ext = sniff_extension(read_head(path))
     except FileNotFoundError:
         print(f"File not found: {row['filename']}")
+        return row
+    if ext not in MEDIA_TYPES or path.suffix.lower() == f".{ext}":
+        return row
+
+    fixed = path.with_suffix(f".{ext}")
+    os.rename(src=path, dst=fixed)
+    renamed[path] = fixed
+    row["filename"] = fixed.name
+    row["path"] = str(fixed)
+    row["actual_media_type"] = MEDIA_TYPES[ext]
     return row
 
 
-df1.apply(fix_filetype, axis=1)
+df1 = df1.apply(fix_filetype, axis=1)  # renamed files are tagged at their new path
+if renamed:
+    # So that the downloader still counts them as done
+    journal = CheckpointJournal(CHECKPOINT).load()
+    for old, new in renamed.items():
+        journal.rename(old, new)
+    journal.compact()
 
 
-tf = TimezoneFinder()
+# Each distinct place is looked up once, and remembered between runs
+with TimezoneResolver(grid=args.tz_grid) as timezones:
+    tz_names = timezones.names_at(df1["correct_latitude"], df1["correct_longitude"])
 
 
 def get_localized_dt_and_offset(
-    utc_dt: datetime, latitude: float, longitude: float
+    utc_dt: datetime, latitude: float, longitude: float, tz_name: str | None
 ) -> tuple[str, str]:
-    tz_name = tf.timezone_at(lng=longitude, lat=latitude)
-
-    utc_timezone = pytz.utc
-    central_timezone = pytz.timezone("America/Chicago")
-    mountain_timezone = pytz.timezone("America/Denver")
-
     if not tz_name or latitude == 0 or longitude == 0:
         print(
             f"⚠️ Warning: No timezone found for {utc_dt.strftime("%Y-%m-%d %H:%M:%S")} UTC. Defaulting to MDT/MST."
         )
-        local_tz = mountain_timezone
+        local_tz = zone("America/Denver")
     else:
-        local_tz = pytz.timezone(tz_name)
+        local_tz = zone(tz_name)
 
     dt_local = utc_dt.astimezone(local_tz)
 
@@ -270,13 +232,15 @@ progress_bar = tqdm(
 )
 
 
-def update_exif_with_exiftool(row: pd.Series) -> None:
-    progress_bar.update(1)
+def get_exiftool_args(row: pd.Series) -> list[str] | None:
+    """
+    The exiftool write arguments for one file, or None to skip it.
+    """
     image_path = row["path"]
     dt_utc = row["correct_date_utc"]  # timezone-aware, UTC datetime
     latitude = row["correct_latitude"]
     longitude = row["correct_longitude"]
-    file_type = row["correct_media_type"]
+    file_type = row["actual_media_type"]  # of the content, which tags must match
     abs_latitude = abs(latitude)
     abs_longitude = abs(longitude)
 
@@ -284,7 +248,7 @@ def update_exif_with_exiftool(row: pd.Series) -> None:
 
     if image_path is None or pd.isna(image_path) or image_path == "":
         print(f"❌ File not found, skipping: {dt_utc_str}")
-        return
+        return None
 
     lat_ref = "N" if latitude >= 0 else "S"
     lon_ref = "E" if longitude >= 0 else "W"
@@ -293,14 +257,14 @@ def update_exif_with_exiftool(row: pd.Series) -> None:
         utc_dt=dt_utc,
         latitude=row["correct_latitude"],
         longitude=row["correct_longitude"],
+        tz_name=tz_names[row.name],
     )
 
     if not os.path.exists(image_path):
         print(f"❌ File not found, skipping: {image_path}")
-        return
+        return None
 
     jpg_command = [
-        "exiftool",
         # Date/Time tags
         f"-IFD0:DateTime={local_dt}",
         f"-ExifIFD:DateTimeOriginal={local_dt}",
@@ -312,20 +276,16 @@ def update_exif_with_exiftool(row: pd.Series) -> None:
         f"-GPSLatitudeRef='{lat_ref}'",
         f"-GPSLongitudeRef='{lon_ref}'",
         "-overwrite_original",
-        image_path,
     ]
     jpg_command_no_gps = [
-        "exiftool",
         # Date/Time tags
         f"-IFD0:DateTime={local_dt}",
         f"-ExifIFD:DateTimeOriginal={local_dt}",
         f"-ExifIFD:DateTimeDigitized={local_dt}",
         f"-OffsetTimeOriginal={dynamic_tz}",
         "-overwrite_original",
-        image_path,
     ]
     mp4_command = [
-        "exiftool",
         # Date/Time tags
         # EXIF Tags
         f"-IFD0:DateTime={local_dt}",
@@ -352,10 +312,8 @@ def update_exif_with_exiftool(row: pd.Series) -> None:
         f"-GPSLatitudeRef={lat_ref}",
         f"-GPSLongitudeRef={lon_ref}",
         "-overwrite_original",
-        image_path,
     ]
     mp4_command_no_gps = [
-        "exiftool",
         # EXIF Tags
         f"-IFD0:DateTime={local_dt}",
         f"-ExifIFD:DateTimeOriginal={local_dt}",
@@ -367,45 +325,39 @@ def update_exif_with_exiftool(row: pd.Series) -> None:
         f"-QuickTime:MediaCreateDate={dt_utc_str}",
         f"-QuickTime:TimeZone={dynamic_tz}",
         "-overwrite_original",
-        image_path,
     ]
 
-    try:
-        if file_type == "Video":
-            if latitude == 0.0 and longitude == 0.0:
-                result = subprocess.run(
-                    mp4_command_no_gps, check=True, capture_output=True, text=True
-                )
-            else:
-                result = subprocess.run(
-                    mp4_command, check=True, capture_output=True, text=True
-                )
-        elif file_type == "Image":
-            if latitude == 0.0 and longitude == 0.0:
-                result = subprocess.run(
-                    jpg_command_no_gps, check=True, capture_output=True, text=True
-                )
-            else:
-                result = subprocess.run(
-                    jpg_command, check=True, capture_output=True, text=True
-                )
-        else:
-            print(f"⚠️ Warning: Unknown media type for {image_path}, skipping.")
-            return
-
-        if "1 image files updated" in result.stdout:
-            pass
-        else:
-            print(f"⚠️ Warning updating {image_path}: {result.stderr.strip()}")
-
-    except subprocess.CalledProcessError as e:
-        print(f"🛑 Subprocess Error on {image_path}: {e.stderr.strip()}")
-    except FileNotFoundError:
-        print(
-            "🛑 ERROR: ExifTool command not found. Is ExifTool installed and in your PATH?"
-        )
-
-
-df1.apply(update_exif_with_exiftool, axis=1)  # type: ignore
-
+    if file_type == "Video":
+        if latitude == 0.0 and longitude == 0.0:
+            return mp4_command_no_gps
+        return mp4_command
+    elif file_type == "Image":
+        if latitude == 0.0 and longitude == 0.0:
+            return jpg_command_no_gps
+        return jpg_command
+    print(f"⚠️ Warning: Unknown media type for {image_path}, skipping.")
+    return None
+
+
+jobs = {}
+for _, row in df1.iterrows():
+    exiftool_args = get_exiftool_args(row)
+    if exiftool_args is None:
+        progress_bar.update(1)
+    else:
+        jobs[Path(row["path"])] = exiftool_args
+
+# One request per file, batched over a pool of long-lived exiftool processes
+try:
+    with ExifToolPool(workers=args.workers, stderr=subprocess.STDOUT) as pool:
+        results = pool.write_tags(jobs, on_done=progress_bar.update)
+except FileNotFoundError:
+    results = {}
+    print(
+        "🛑 ERROR: ExifTool command not found. Is ExifTool installed and in your PATH?"
+    )
 progress_bar.close()
+
+for image_path, error in results.items():
+    if error is not None:
+        print(f"⚠️ Warning updating {image_path}: {error}")